@@ -0,0 +1,89 @@
+"""章节 HTML 提取基准：core.html_blocks 与原 BeautifulSoup 流程对比
+
+用法: python bench_html_extract.py [段落数]
+未安装 bs4 时只测新提取器。
+"""
+import sys
+import time
+
+from core import html_blocks
+from core.html_blocks import extract_blocks
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+
+def make_chapter(paragraphs):
+    body = []
+    for i in range(paragraphs):
+        body.append(f'<p class="p{i % 3}">第{i}段，这是用于测试的正文内容，<span>夹杂</span>少量行内标签&amp;实体。</p>')
+        if i % 50 == 0:
+            body.append(f'<div class="sec"><h2>小节 {i}</h2><div><p>嵌套段落 {i}</p></div></div>')
+        if i % 200 == 0:
+            body.append(f'<div class="img"><img src="../Images/{i}.jpg"/></div>')
+    return ('<?xml version="1.0" encoding="utf-8"?><html><head><title>T</title>'
+            '<style>p { margin: 0 }</style></head><body>' + "".join(body) + '</body></html>')
+
+
+def bs4_epub(markup):
+    """原 EpubParser 的提取流程"""
+    soup = BeautifulSoup(markup, 'html.parser')
+    blocks = []
+    for tag in soup.find_all(['p', 'img', 'image', 'h1', 'h2', 'h3']):
+        if tag.name in ('img', 'image'):
+            blocks.append({'type': 'img', 'content': tag.get('src')})
+        else:
+            txt = tag.get_text().strip()
+            if txt: blocks.append({'type': 'text', 'content': txt})
+    return blocks
+
+
+def bs4_mobi(markup):
+    """原 MobiParser 的提取流程"""
+    soup = BeautifulSoup(markup, 'html.parser')
+    for s in soup(['style', 'script']): s.decompose()
+    blocks = []
+    for tag in soup.find_all(['p', 'div', 'img', 'h1', 'h2', 'h3', 'image']):
+        if tag.name in ['img', 'image']:
+            blocks.append({'type': 'img', 'content': tag.get('src')})
+        elif not tag.find(['p', 'div']):
+            txt = tag.get_text().strip()
+            if txt and len(txt) > 1 and not ('{' in txt and '}' in txt):
+                blocks.append({'type': 'text', 'content': txt})
+    return blocks
+
+
+def bench(name, fn, markup, rounds=5):
+    best = float('inf')
+    for _ in range(rounds):
+        t = time.perf_counter()
+        n = len(fn(markup))
+        best = min(best, time.perf_counter() - t)
+    print(f"{name:<24}{best * 1000:9.1f} ms  {n} 块")
+    return best
+
+
+def main():
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    markup = make_chapter(paragraphs)
+    print(f"章节大小: {len(markup.encode('utf-8')) // 1024} KB, {paragraphs} 段")
+
+    img = lambda attrs: {'type': 'img', 'content': attrs.get('src')}
+    new = bench("html_blocks" + (" (lxml)" if html_blocks.etree else ""), lambda m: extract_blocks(m, img), markup)
+    if html_blocks.etree:
+        saved, html_blocks.etree = html_blocks.etree, None
+        bench("html_blocks (html.parser)", lambda m: extract_blocks(m, img), markup)
+        html_blocks.etree = saved
+
+    if BeautifulSoup is None:
+        print("未安装 beautifulsoup4，跳过对比")
+        return
+    for name, fn in (("bs4 (EPUB 旧流程)", bs4_epub), ("bs4 (MOBI 旧流程)", bs4_mobi)):
+        old = bench(name, fn, markup)
+        print(f"{'':<24}加速 {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,88 @@
 from abc import ABC, abstractmethod
+from .chapter_cache import CHAPTER_CACHE
+from .tasks import ScanTask, SCAN_EXECUTOR, PREFETCH_EXECUTOR
+
+# 扫描进度回调的最小间隔（秒），每次只回传上次之后新增的章节
+PROGRESS_INTERVAL = 0.2
 
 class BaseParser(ABC):
     def __init__(self, file_path):
         self.file_path = file_path
         self.chapters = [] # 存储结构: [(标题, 索引/偏移), ...]
+        self.chapter_stats = [] # 可选: 与 chapters 对应的 [(字符数, 汉字数), ...]
+        self._cache_token = object() # 目录或内容变化时更换，旧缓存随之失效
+        self._prefetch_gen = 0
+        self._scan_task = None
 
-    @abstractmethod
     def scan(self, rule, callback, task_id):
-        """异步解析目录结构"""
+        """在共享线程池中异步解析目录结构，返回可取消的 ScanTask；会先取消本解析器上一次扫描"""
+        self.stop_scan()
+        task = self._scan_task = ScanTask()
+        task.future = SCAN_EXECUTOR.submit(self._run_scan, rule, callback, task_id, task)
+        return task
+
+    def _run_scan(self, rule, callback, task_id, task):
+        if task.cancelled: return
+        try:
+            self.run_scan(rule, callback, task_id, task)
+        except Exception as e:
+            print(f"目录解析出错: {e}")
+
+    @abstractmethod
+    def run_scan(self, rule, callback, task_id, task):
+        """在工作线程中解析目录；应不时检查 task.cancelled，被取消后尽快返回且不再回调
+
+        回调 callback(task_id, 新章节, 字数, 汉字数, 是否完成)；扫描中途从头重来时
+        以 None 代替新章节回调一次，界面据此清空已追加的目录。
+        """
         pass
 
+    def stop_scan(self):
+        if self._scan_task: self._scan_task.cancel()
+
     @abstractmethod
-    def get_content(self, index):
-        """获取指定章节的纯文本内容"""
+    def load_content(self, index):
+        """读取并处理指定章节（纯文本或块列表），由 get_content 负责缓存"""
         pass
 
+    def get_content(self, index):
+        """获取指定章节内容，优先命中共享的章节缓存"""
+        key = (self._cache_token, index)
+        content = CHAPTER_CACHE.get(key)
+        if content is None:
+            content = self.load_content(index)
+            # 读取期间目录/正文可能已变化（如扫描中逐块作废），旧令牌下的结果不再缓存
+            if key[0] is self._cache_token: CHAPTER_CACHE.put(key, content)
+        return content
+
+    def prefetch(self, index, radius=1):
+        """后台预取前后 radius 章；翻页后旧的预取请求自动作废"""
+        self._prefetch_gen += 1
+        gen, token = self._prefetch_gen, self._cache_token
+        order = [index + d * s for d in range(1, radius + 1) for s in (1, -1)]
+
+        def _work():
+            for i in order:
+                if gen != self._prefetch_gen or token is not self._cache_token: return
+                if 0 <= i < len(self.chapters) and (token, i) not in CHAPTER_CACHE:
+                    try:
+                        content = self.load_content(i)
+                        if token is self._cache_token: CHAPTER_CACHE.put((token, i), content)
+                    except Exception as e:
+                        print(f"预取第 {i} 章失败: {e}")
+
+        if radius > 0: PREFETCH_EXECUTOR.submit(_work)
+
+    def invalidate_content(self):
+        """目录或正文变化后调用，丢弃本解析器已缓存的章节"""
+        CHAPTER_CACHE.discard_owner(self._cache_token)
+        self._cache_token = object()
+
     def save_content(self, index, text):
         """默认不支持保存，仅 TXT 子类重写此方法"""
         return False
+
+    def close(self):
+        """释放文件句柄等资源并取消进行中的扫描，切换书籍时由 UI 调用"""
+        self.stop_scan()
+        self.invalidate_content()
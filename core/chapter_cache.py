@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+
+# 所有解析器共享的章节内容缓存上限（按文本字符数/图片字节数估算）
+MAX_CACHE_SIZE = 48 * 1024 * 1024
+
+
+def _estimate_size(content):
+    if isinstance(content, str):
+        return len(content)
+    return sum(len(b.get('content') or b'') for b in content) + 64 * len(content)
+
+
+class ChapterCache:
+    """处理后章节内容的 LRU 缓存，键为 (解析器令牌, 章节索引)"""
+
+    def __init__(self, max_size=MAX_CACHE_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None: return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def put(self, key, content):
+        size = _estimate_size(content)
+        if size > self.max_size: return # 单章超过上限时不缓存
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old: self._size -= old[1]
+            self._items[key] = (content, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, s) = self._items.popitem(last=False)
+                self._size -= s
+
+    def discard_owner(self, token):
+        """丢弃某个解析器（某一版目录）的全部缓存"""
+        with self._lock:
+            for key in [k for k in self._items if k[0] is token]:
+                self._size -= self._items.pop(key)[1]
+
+
+CHAPTER_CACHE = ChapterCache()
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import struct
+
+from utils.config import get_cache_dir
+
+# 合并写盘/日志重放时每次复制的块大小，避免把整本书读进内存
+COPY_CHUNK = 8 * 1024 * 1024
+
+
+class PieceTable:
+    """片段表：原始缓冲区 + 编辑片段拼成的逻辑文本
+
+    每个片段为 (来源对象, 来源内偏移, 长度)，来源是原文件的 bytes/mmap 或一次编辑写入的 bytes。
+    替换只改动片段列表，不复制原文，因此保存一章的代价与整本书大小无关。
+    """
+
+    def __init__(self, base):
+        self.pieces = [(base, 0, len(base))] if len(base) else []
+        self.version = 0 # 每次编辑递增，后台合并据此判断快照是否过期
+        self._size = len(base)
+
+    @property
+    def dirty(self):
+        return self.version != 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("PieceTable 只支持切片读取")
+        start, end, _ = key.indices(self._size)
+        return self.read(start, end)
+
+    def read(self, start, end):
+        out, pos = [], 0
+        for src, off, ln in self.pieces:
+            if pos >= end: break
+            if pos + ln > start:
+                a, b = max(start, pos) - pos, min(end, pos + ln) - pos
+                out.append(src[off + a:off + b])
+            pos += ln
+        return out[0] if len(out) == 1 else b"".join(out)
+
+    def replace(self, start, end, data):
+        new, pos, inserted = [], 0, False
+        for src, off, ln in self.pieces:
+            p_start, p_end = pos, pos + ln
+            pos = p_end
+            if p_end <= start:
+                new.append((src, off, ln))
+                continue
+            if p_start < start:
+                new.append((src, off, start - p_start))
+            if not inserted:
+                if data: new.append((data, 0, len(data)))
+                inserted = True
+            if p_end > end:
+                keep = max(end, p_start)
+                new.append((src, off + keep - p_start, p_end - keep))
+        if not inserted and data:
+            new.append((data, 0, len(data)))
+        self.pieces = new
+        self._size += len(data) - (end - start)
+        self.version += 1
+
+    def snapshot(self):
+        """当前内容的只读副本；片段来源共享，之后的编辑不影响副本"""
+        snap = PieceTable(b"")
+        snap.pieces, snap.version, snap._size = self.pieces, self.version, self._size
+        return snap
+
+    def iter_chunks(self, pieces=None):
+        """按块产出逻辑文本，供合并写盘使用"""
+        for src, off, ln in (self.pieces if pieces is None else pieces):
+            for o in range(off, off + ln, COPY_CHUNK):
+                yield src[o:min(o + COPY_CHUNK, off + ln)]
+
+
+class EditJournal:
+    """追加写的编辑日志
+
+    保存时只把 (起始, 结束, 新内容) 追加到日志并落盘，正文由后台合并。
+    日志头记录原文件的大小和修改时间；原文件被合并替换后两者必然变化，
+    因此残留的旧日志会被识别为已失效并丢弃，不会被重复应用。
+    """
+
+    MAGIC = b"NRJ1"
+    HEADER = struct.Struct("<4sQQ")
+    RECORD = struct.Struct("<QQQ")
+
+    def __init__(self, book_path):
+        key = hashlib.sha1(os.path.abspath(book_path).encode('utf-8', 'surrogatepass')).hexdigest()
+        self.book_path = book_path
+        cache_dir = get_cache_dir("journal")
+        # 日志目录不可用时仍可阅读，只有保存编辑会失败
+        self.path = os.path.join(cache_dir, key + ".journal") if cache_dir else None
+
+    def _identity(self):
+        st = os.stat(self.book_path)
+        return st.st_size, st.st_mtime_ns
+
+    def replay(self):
+        """返回仍适用于当前文件的编辑 [(start, end, data), ...]"""
+        if not self.path or not os.path.exists(self.path): return []
+        edits = []
+        try:
+            with open(self.path, 'rb') as f:
+                magic, size, mtime_ns = self.HEADER.unpack(f.read(self.HEADER.size))
+                if magic != self.MAGIC or (size, mtime_ns) != self._identity():
+                    raise ValueError("日志与当前文件不匹配")
+                while True:
+                    head = f.read(self.RECORD.size)
+                    if len(head) < self.RECORD.size: break
+                    start, end, n = self.RECORD.unpack(head)
+                    data = f.read(n)
+                    if len(data) < n: break # 写到一半的尾记录，忽略
+                    edits.append((start, end, data))
+        except Exception as e:
+            print(f"丢弃失效的编辑日志: {e}")
+            self.discard()
+            return []
+        return edits
+
+    def append(self, start, end, data):
+        if not self.path: raise OSError("缓存目录不可写，无法记录编辑日志")
+        new = not os.path.exists(self.path)
+        with open(self.path, 'ab') as f:
+            if new:
+                f.write(self.HEADER.pack(self.MAGIC, *self._identity()))
+            f.write(self.RECORD.pack(start, end, len(data)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def size(self):
+        """日志文件当前的字节数"""
+        try:
+            return os.path.getsize(self.path) if self.path else 0
+        except OSError:
+            return 0
+
+    def discard(self):
+        try:
+            if self.path: os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,172 @@
+import io
+import posixpath
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from urllib.parse import unquote
+
+EPUB_OPS_NS = "{http://www.idpf.org/2007/ops}"
+
+# 解压后的成员缓存条数（章节 XHTML 通常只有几十 KB，翻页来回时避免重复解压）
+MEMBER_CACHE_SIZE = 16
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def resolve_href(base_dir, href):
+    """把相对 href（可能带 URL 编码和 #片段）解析为归档内的规范路径"""
+    href = unquote(href.split('#', 1)[0]).replace('\\', '/')
+    if not href: return ""
+    return posixpath.normpath(posixpath.join(base_dir, href)).lstrip('/')
+
+
+class EpubArchive:
+    """直接基于 zipfile 的 EPUB 读取
+
+    打开时只读取 container.xml、OPF 清单和阅读顺序 (spine)，正文和图片在用到时才单独解压，
+    因此打开速度与归档大小基本无关。
+    """
+
+    def __init__(self, path):
+        self.zf = zipfile.ZipFile(path)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        # 兼容大小写不一致的归档（Windows 下打包的书常见）
+        self._names = {n: n for n in self.zf.namelist()}
+        self._lower = {n.lower(): n for n in self._names}
+
+        self.opf_path = self._find_opf()
+        self.opf_dir = posixpath.dirname(self.opf_path)
+        self.manifest = {} # id -> (路径, media-type, properties)
+        self.spine = [] # 阅读顺序的文档路径
+        self.toc_id = None # EPUB2 的 NCX 清单 id
+        self._parse_opf()
+
+    def _find_opf(self):
+        try:
+            root = ET.fromstring(self.read("META-INF/container.xml"))
+            for rf in root.iterfind(".//{*}rootfile"):
+                p = rf.get("full-path")
+                if p and self.member(p): return self.member(p)
+        except Exception as e:
+            print(f"container.xml 解析失败: {e}")
+        # 容错：container.xml 缺失或损坏时取第一个 .opf
+        for n in self._names:
+            if n.lower().endswith(".opf"): return n
+        raise ValueError("找不到 OPF 文件")
+
+    def _parse_opf(self):
+        root = ET.fromstring(self.read(self.opf_path))
+        for item in root.iterfind(".//{*}manifest/{*}item"):
+            href = item.get("href")
+            if not href: continue
+            self.manifest[item.get("id")] = (
+                resolve_href(self.opf_dir, href),
+                item.get("media-type", ""),
+                item.get("properties", ""),
+            )
+        for spine in root.iterfind(".//{*}spine"):
+            self.toc_id = spine.get("toc")
+            for ref in spine.iterfind("{*}itemref"):
+                entry = self.manifest.get(ref.get("idref"))
+                if entry and self.member(entry[0]):
+                    self.spine.append(self.member(entry[0]))
+            break
+
+    def member(self, path):
+        """返回归档内实际的成员名，不存在时返回 None"""
+        return self._names.get(path) or self._lower.get(path.lower())
+
+    def read(self, path, cache=True):
+        """解压单个成员；path 须为归档内路径。图片等大文件传 cache=False，不占用成员缓存"""
+        name = self.member(path)
+        if name is None: raise KeyError(path)
+        with self._lock:
+            data = self._cache.get(name)
+            if data is not None:
+                self._cache.move_to_end(name)
+                return data
+            data = self.zf.read(name)
+            if not cache: return data
+            self._cache[name] = data
+            if len(self._cache) > MEMBER_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return data
+
+    def head(self, path, size=4096):
+        """只解压成员开头 size 字节，用于嗅探标题"""
+        name = self.member(path)
+        if name is None: return b""
+        with self._lock:
+            with self.zf.open(name) as f:
+                return f.read(size)
+
+    def toc_entries(self):
+        """读取书内目录，返回 [(标题, 文档路径, 层级), ...]，按目录顺序，嵌套条目紧随父条目
+
+        优先 EPUB3 的 nav 文档，失败或缺失时退回 EPUB2 的 toc.ncx；都没有则返回空列表。
+        """
+        for path, media_type, props in self.manifest.values():
+            if "nav" in props.split():
+                try:
+                    entries = self._parse_nav(path)
+                    if entries: return entries
+                except Exception as e:
+                    print(f"nav 目录解析失败: {e}")
+                break
+        ncx = self.manifest.get(self.toc_id)
+        if ncx is None:
+            ncx = next((v for v in self.manifest.values() if v[1] == "application/x-dtbncx+xml"), None)
+        if ncx and self.member(ncx[0]):
+            try:
+                return self._parse_ncx(ncx[0])
+            except Exception as e:
+                print(f"NCX 目录解析失败: {e}")
+        return []
+
+    def _parse_ncx(self, path):
+        base, entries, stack = posixpath.dirname(path), [], []
+        for event, elem in ET.iterparse(io.BytesIO(self.read(path)), events=("start", "end")):
+            tag = _local(elem.tag)
+            if tag == "navPoint":
+                if event == "start":
+                    stack.append({})
+                else:
+                    stack.pop()
+                    elem.clear()
+            elif event == "end" and stack:
+                top = stack[-1]
+                if tag == "text" and "title" not in top:
+                    top["title"] = (elem.text or "").strip()
+                elif tag == "content" and "src" not in top:
+                    top["src"] = elem.get("src", "")
+                    entries.append((top.get("title", ""), resolve_href(base, top["src"]), len(stack) - 1))
+        return entries
+
+    def _parse_nav(self, path):
+        base, entries = posixpath.dirname(path), []
+        in_toc, depth = False, 0
+        for event, elem in ET.iterparse(io.BytesIO(self.read(path)), events=("start", "end")):
+            tag = _local(elem.tag)
+            if tag == "nav":
+                if event == "start" and not in_toc:
+                    # 只取 epub:type="toc" 的导航，跳过 landmarks / page-list
+                    in_toc = "toc" in elem.get(EPUB_OPS_NS + "type", "").split()
+                elif event == "end" and in_toc:
+                    break
+                continue
+            if not in_toc: continue
+            if tag == "ol":
+                depth += 1 if event == "start" else -1
+            elif tag == "a" and event == "end" and elem.get("href"):
+                title = " ".join("".join(elem.itertext()).split())
+                entries.append((title, resolve_href(base, elem.get("href")), max(depth - 1, 0)))
+        return entries
+
+    def close(self):
+        with self._lock:
+            self._cache.clear()
+            self.zf.close()
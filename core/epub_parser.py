@@ -1,50 +1,108 @@
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
-from .base_parser import BaseParser
+import html
+import posixpath
+import re
 import threading
+from .base_parser import BaseParser
+from .epub_archive import EpubArchive, resolve_href
+from .html_blocks import extract_blocks
+
+# 书内目录没有覆盖到的文档，只嗅探开头这么多字节里的 <h1>/<title>
+TITLE_SNIFF_BYTES = 4096
+_H1_RE = re.compile(rb'<h1[^>]*>(.*?)</h1>', re.S | re.I)
+_TITLE_RE = re.compile(rb'<title[^>]*>(.*?)</title>', re.S | re.I)
+
+
+def _sniff_title(head):
+    for reg in (_H1_RE, _TITLE_RE):
+        m = reg.search(head)
+        if m:
+            t = re.sub(r'<[^>]+>', '', m.group(1).decode('utf-8', 'ignore'))
+            t = " ".join(html.unescape(t).split())
+            if t: return t
+    return None
+
 
 class EpubParser(BaseParser):
     def __init__(self, file_path):
         super().__init__(file_path)
-        self.book = None
-        self.items = []
-
-    def scan(self, rule, callback, task_id):
-        def _task():
-            try:
-                self.book = epub.read_epub(self.file_path)
-                # 只获取文档类型的项目
-                self.items = [item for item in self.book.get_items() if item.get_type() == ebooklib.ITEM_DOCUMENT]
-                
-                self.chapters = []
-                # 【优化】不再解析 HTML 找标题，直接使用 EPUB 的文件名或索引
-                # 这样加载目录是瞬间完成的
-                for i, item in enumerate(self.items):
-                    # 如果想获取真实标题，只读取前 2048 字节进行简单正则匹配，而不是 BeautifulSoup
-                    title = f"第 {i+1} 章节"
-                    self.chapters.append((title, i))
-                
-                callback(task_id, self.chapters, 0, 0, True)
-            except Exception as e:
-                print(f"EPUB解析出错: {e}")
-        
-        threading.Thread(target=_task, daemon=True).start()
-
-    def get_content(self, index):
-        """只有在看这一章时，才解析这一章的 HTML"""
+        self.archive = None
+        self._io_lock = threading.Lock()
+        self._closed = False # close() 之后扫描线程新打开的归档由其自行关闭
+        self.items = [] # 阅读顺序的文档路径
+        # 图片索引，扫描时建立一次：规范化路径(小写) / 文件名(小写) -> 归档成员名
+        self.images, self.image_names = {}, {}
+
+    def run_scan(self, rule, callback, task_id, task):
+        archive = self.archive
+        try:
+            # 只读 container.xml / OPF / spine，正文到阅读时才解压
+            if archive is None: archive = EpubArchive(self.file_path)
+            if task.cancelled: return
+            items = list(archive.spine)
+
+            # 标题取自书内目录 (nav/NCX)；同一文档有多个条目（含嵌套小节）时取最先出现的
+            titles = {}
+            for title, path, depth in archive.toc_entries():
+                path = archive.member(path) or path
+                if title and path not in titles: titles[path] = title
+
+            chapters = []
+            for i, item in enumerate(items):
+                title = titles.get(item)
+                if not title:
+                    if task.cancelled: return
+                    title = _sniff_title(archive.head(item, TITLE_SNIFF_BYTES))
+                chapters.append((title or f"第 {i+1} 章节", i))
+            if task.cancelled: return
+
+            images, image_names = {}, {}
+            for path, media_type, props in archive.manifest.values():
+                member = archive.member(path) if media_type.startswith('image/') else None
+                if member:
+                    images[member.lower()] = member
+                    image_names.setdefault(posixpath.basename(member).lower(), member)
+
+            with self._io_lock:
+                if task.cancelled or self._closed: return
+                self.archive, self.items, self.chapters = archive, items, chapters
+                self.images, self.image_names = images, image_names
+            self.invalidate_content()
+            callback(task_id, self.chapters, 0, 0, True)
+        except Exception as e:
+            print(f"EPUB解析出错: {e}")
+        finally:
+            # 本次新打开、却因取消/关闭/出错没有公开的归档，没有人会再关闭它
+            if archive is not None and archive is not self.archive: archive.close()
+
+    def load_content(self, index):
+        """只有在看这一章时，才解压并解析这一章的 HTML"""
         if 0 <= index < len(self.items):
-            soup = BeautifulSoup(self.items[index].get_content(), 'html.parser')
-            blocks = []
-            for tag in soup.find_all(['p', 'img', 'h1', 'h2', 'h3']):
-                if tag.name == 'img':
-                    src = tag.get('src', '').split('/')[-1]
-                    for img_item in self.book.get_items_of_type(ebooklib.ITEM_IMAGE):
-                        if src in img_item.file_name:
-                            blocks.append({'type': 'img', 'content': img_item.get_content()})
-                            break
-                else:
-                    txt = tag.get_text().strip()
-                    if txt: blocks.append({'type': 'text', 'content': txt})
-            return blocks
+            path = self.items[index]
+            return extract_blocks(self.archive.read(path), lambda attrs: self._image_block(path, attrs))
         return []
+
+    def _image_block(self, doc_path, attrs):
+        # <image> 为 SVG 内嵌的插图
+        data = self._read_image(doc_path, attrs.get('src') or attrs.get('xlink:href') or attrs.get('href'))
+        return {'type': 'img', 'content': data} if data else None
+
+    def _read_image(self, doc_path, src):
+        if not src: return None
+        target = resolve_href(posixpath.dirname(doc_path), src).lower()
+        # 路径写错的书：退回按文件名匹配
+        member = self.images.get(target) or self.image_names.get(posixpath.basename(target))
+        if not member: return None
+        try:
+            return self.archive.read(member, cache=False)
+        except KeyError:
+            return None
+
+    def close(self):
+        super().close()
+        with self._io_lock:
+            self._closed = True
+            if self.archive:
+                try:
+                    self.archive.close()
+                except Exception:
+                    pass
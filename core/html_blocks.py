@@ -0,0 +1,124 @@
+import re
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# 这些标签的开始/结束都是段落边界，嵌套时只切分不重复输出
+BLOCK_TAGS = {
+    'p', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'dt', 'dd', 'tr',
+    'blockquote', 'section', 'article', 'header', 'footer', 'aside', 'pre', 'br', 'hr',
+    'ul', 'ol', 'table', 'body', 'figure', 'figcaption',
+}
+SKIP_TAGS = {'style', 'script', 'head', 'title'}
+IMG_TAGS = {'img', 'image'}
+
+_ENCODING_RE = re.compile(rb'''encoding=["']([\w.:-]+)["']|charset=["']?([\w.:-]+)''', re.I)
+
+
+def _decode(markup):
+    if isinstance(markup, str): return markup
+    try:
+        return markup.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    m = _ENCODING_RE.search(markup[:1024])
+    if m:
+        try:
+            return markup.decode((m.group(1) or m.group(2)).decode('ascii'), 'replace')
+        except LookupError:
+            pass
+    return markup.decode('utf-8', 'replace')
+
+
+class _BlockCollector:
+    """单遍收集块：文字累积到段落边界时输出，图片标签交给 resolve_img 定位
+
+    接口与 lxml 的 parser target 一致 (start/end/data/close)，标准库解析器也转调这里。
+    """
+
+    def __init__(self, resolve_img, min_len, drop_css):
+        self.resolve_img = resolve_img
+        self.min_len = min_len
+        self.drop_css = drop_css
+        self.blocks = []
+        self._buf = []
+        self._skip = 0
+
+    def _flush(self):
+        if not self._buf: return
+        txt = "".join(self._buf).strip()
+        self._buf = []
+        if len(txt) < self.min_len: return
+        # 截断的 <style> 残片（片段从样式中间开始时）会以 CSS 代码形式出现
+        if self.drop_css and '{' in txt and '}' in txt: return
+        self.blocks.append({'type': 'text', 'content': txt})
+
+    def start(self, tag, attrs):
+        tag = tag.rsplit('}', 1)[-1].lower()
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif self._skip:
+            return
+        elif tag in BLOCK_TAGS:
+            self._flush()
+        elif tag in IMG_TAGS:
+            self._flush()
+            block = self.resolve_img(attrs) if self.resolve_img else None
+            if block: self.blocks.append(block)
+
+    def end(self, tag):
+        tag = tag.rsplit('}', 1)[-1].lower()
+        if tag in SKIP_TAGS:
+            self._skip = max(self._skip - 1, 0)
+        elif not self._skip and tag in BLOCK_TAGS:
+            self._flush()
+
+    def data(self, text):
+        if not self._skip: self._buf.append(text)
+
+    def close(self):
+        self._flush()
+        return self.blocks
+
+
+class _StdParser(HTMLParser):
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, dict(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.target.start(tag, dict(attrs))
+        self.target.end(tag)
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+
+def extract_blocks(markup, resolve_img=None, min_len=1, drop_css=False):
+    """把 HTML（str 或 bytes）单遍转换为 [{'type': 'text'|'img', 'content': ...}, ...]
+
+    resolve_img(attrs) 接收图片标签的属性字典，返回图片块或 None。
+    装了 lxml 时用其 C 解析器驱动，否则使用标准库 html.parser，两者输出一致。
+    """
+    text = _decode(markup)
+    if etree is not None:
+        try:
+            collector = _BlockCollector(resolve_img, min_len, drop_css)
+            parser = etree.HTMLParser(target=collector, encoding='utf-8')
+            return etree.fromstring(text.encode('utf-8', 'surrogatepass'), parser) or []
+        except Exception:
+            pass # lxml 处理不了的残缺片段交给标准库
+    collector = _BlockCollector(resolve_img, min_len, drop_css)
+    parser = _StdParser(collector)
+    parser.feed(text)
+    parser.close()
+    return collector.close()
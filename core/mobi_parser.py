@@ -1,166 +1,330 @@
-import mobi
+try:
+    import mobi
+except ImportError:
+    mobi = None # 旧版 MOBI 由内置读取器处理，KF8 (AZW3) 等读取器不支持的才需要完整解包
 import os
-import threading
 import re
 import html
-from bs4 import BeautifulSoup
-from .base_parser import BaseParser
+import mmap
+import shutil
+import threading
+import time
+from .base_parser import BaseParser, PROGRESS_INTERVAL
+from .epub_archive import resolve_href
+from .html_blocks import extract_blocks
+from .mobi_reader import MobiBook, RecordSizeError
+from utils.extract_cache import ExtractCache, fingerprint
+
+# 带 id/name 属性的标签，偏移记在标签的 '<' 处
+ANCHOR_RE = re.compile(rb'''<[a-zA-Z][^>]*?\s(?:id|name)\s*=\s*["']([^"'>]+)["']''')
+# 标题部分限定长度，保证匹配不会超出窗口重叠区
+LINK_RE = re.compile(rb'''href=["']#([^"']+)["'][^>]*>(.{0,2000}?)</a>''', re.S)
+# 旧版 MOBI 的目录链接直接给出正文字节偏移：<a filepos=0000012345>
+FILEPOS_RE = re.compile(rb'''<a\s[^>]*?filepos=["']?(\d+)["']?[^>]*>(.{0,2000}?)</a>''', re.S | re.I)
+HEADING_RE = re.compile(rb'<(h[1-4])[^>]*>(.{0,2000}?)</\1>', re.S | re.I)
+TAG_RE = re.compile(r'<[^>]+>')
+# 全文扫描的窗口大小；重叠部分保证跨窗口的标签不会被切断
+WINDOW_SIZE = 4 * 1024 * 1024
+WINDOW_OVERLAP = 64 * 1024
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg')
+
+
+def _text(raw, encoding='utf-8'):
+    """目录片段（字节）-> 去标签、反转义后的纯文本"""
+    return html.unescape(TAG_RE.sub('', raw.decode(encoding, 'ignore'))).strip()
+
+
+def _iter_windows(buf, size=WINDOW_SIZE, overlap=WINDOW_OVERLAP):
+    """按固定大小、首尾重叠的窗口遍历字节源，内存占用与文件大小无关"""
+    total = len(buf)
+    for base in range(0, total, size):
+        yield base, buf[base:min(base + size + overlap, total)]
+
+
+def _add_markers(chapters, offsets, markers):
+    """按偏移顺序追加章节，与上一章相距过近（500 字节内）的视为同一处"""
+    for pos, title in markers:
+        if not offsets or pos - offsets[-1] > 500:
+            chapters.append((title, pos))
+            offsets.append(pos)
+
 
 class MobiParser(BaseParser):
     def __init__(self, file_path):
         super().__init__(file_path)
         self.temp_dir = None
         self.html_path = None
+        self.extract_cache = ExtractCache()
+        self._owns_temp = False # 缓存写入失败时解压目录归本实例所有，关闭时删除
+        self.book = None # 内置读取器（旧版 MOBI），为 None 时使用解包出的 HTML
+        self._buf = None # 正文字节源：MobiBook 或解包 HTML 的只读 mmap，章节按字节区间切片读取
+        self.encoding = 'utf-8'
+        self._io_lock = threading.Lock()
+        self._closed = False # close() 之后扫描线程新打开/解压的资源由其自行释放
         self.chapters = []
         self.chapter_offsets = []
+        self._scan_limit = None # 扫描中：已扫描到的位置，即末章暂时的结束位置
+        # 图片索引，扫描时建立一次：解压目录内相对路径 / 文件名 / recindex -> 图片文件路径
+        self.images, self.image_names, self.image_recs = {}, {}, {}
+
+    def run_scan(self, rule, callback, task_id, task):
+        try:
+            # 1. 旧版 MOBI 直接读记录，不解包；KF8 等才解压出 HTML（解压结果缓存在磁盘上，重开时直接复用）
+            if self._buf is None: self._open_source()
 
-    def scan(self, rule, callback, task_id):
-        def _task():
             try:
-                # 1. 解压并寻找核心 HTML
-                self.temp_dir, self.html_path = mobi.extract(self.file_path)
-                
-                # 寻找最大的内容文件（通常是正文）
-                candidates = []
-                for root, dirs, files in os.walk(self.temp_dir):
-                    for f in files:
-                        if f.endswith(('.xhtml', '.html')):
-                            candidates.append(os.path.join(root, f))
-                if candidates:
-                    self.html_path = max(candidates, key=os.path.getsize)
-
-                # 2. 扫描目录 (为了性能，依然使用正则读取前 5MB)
-                with open(self.html_path, 'rb') as f:
-                    raw_data = f.read(5000000)
-                text_sample = raw_data.decode('utf-8', errors='ignore')
-                
-                # 剔除干扰
-                text_sample = re.sub(r'<(style|script|head)>.*?</\1>', '', text_sample, flags=re.S | re.I)
-                
-                markers = []
-                # 策略 A：锚点法 (大合集常用)
-                links = re.findall(r'href=["\']#([^"\']+)["\'][^>]*>(.*?)</a>', text_sample, re.S)
-                if len(links) > 5:
-                    # 获取全文内容进行定位
-                    with open(self.html_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        full_txt = f.read()
-                        for ref_id, title in links:
-                            t = re.sub(r'<[^>]+>', '', title).strip()
-                            if 2 < len(t) < 80:
-                                pos = full_txt.find(f'id="{ref_id}"')
-                                if pos == -1: pos = full_txt.find(f'name="{ref_id}"')
-                                if pos != -1: markers.append((pos, t))
-                        del full_txt
-
-                # 策略 B：H标签法 (小 MOBI 常用)
-                if len(markers) < 5:
-                    for m in re.finditer(r'<(h[1-4])[^>]*>(.*?)</\1>', text_sample, re.S | re.I):
-                        t = re.sub(r'<[^>]+>', '', m.group(2)).strip()
-                        if 1 < len(t) < 60: markers.append((m.start(), t))
-
-                # 排序并去重
-                markers = sorted(list(set(markers)), key=lambda x: x[0])
-
-                # 3. 整理结果
-                if not markers:
-                    size = os.path.getsize(self.html_path)
-                    for i in range(0, size, 120000):
-                        self.chapters.append((f"第 {i//120000 + 1} 部分", i))
-                        self.chapter_offsets.append(i)
-                else:
-                    last_pos = -1
-                    for pos, title in markers:
-                        if pos - last_pos > 500:
-                            self.chapters.append((html.unescape(title), pos))
-                            self.chapter_offsets.append(pos)
-                            last_pos = pos
-
-                callback(task_id, self.chapters, os.path.getsize(self.html_path), 0, True)
-            except Exception as e:
-                print(f"MOBI解析失败: {e}")
-        
-        threading.Thread(target=_task, daemon=True).start()
-
-    def get_content(self, index):
-        if not self.html_path or index >= len(self.chapter_offsets): return []
-        
-        start = self.chapter_offsets[index]
-        end = self.chapter_offsets[index+1] if index+1 < len(self.chapter_offsets) else -1
-        
+                self._scan(callback, task_id, task)
+            except RecordSizeError as e:
+                # 记录长度与头部不符，偏移无法换算到记录：丢掉内置读取器，完整解包后重扫
+                print(f"内置 MOBI 读取器无法读取此文件，改为完整解包: {e}")
+                self._open_source(native=False)
+                # 已回传的章节作废：让界面清空目录，重扫时从头增量回传
+                if not task.cancelled: callback(task_id, None, 0, 0, False)
+                self._scan(callback, task_id, task)
+        except Exception as e:
+            print(f"MOBI解析失败: {e}")
+
+    def _scan(self, callback, task_id, task):
+        if task.cancelled: return
+        buf, enc = self._buf, self.encoding
+        size = len(buf) if buf is not None else 0
+
+        # 目录边扫边公开，界面可以实时显示并点击已扫到的章节
+        chapters, offsets = [], []
+        with self._io_lock:
+            self.chapters, self.chapter_offsets, self._scan_limit = chapters, offsets, 0
+        self.invalidate_content()
+
+        # 2. 以重叠窗口流式扫描全文：目录链接、锚点、H 标签一遍收集，内存占用与文件大小无关
+        filepos, links, headings, anchors, wanted = [], [], [], {}, set()
+        reported, last_report = 0, time.monotonic()
+        for base, window in (_iter_windows(buf) if buf is not None else ()):
+            if task.cancelled: return
+            # 只收起点在本窗口主体内的匹配，重叠区留给下一个窗口，避免重复
+            limit = WINDOW_SIZE if base + WINDOW_SIZE < size else len(window)
+            for m in FILEPOS_RE.finditer(window):
+                if m.start() >= limit: break
+                filepos.append((int(m.group(1)), _text(m.group(2), enc)))
+            for m in LINK_RE.finditer(window):
+                if m.start() >= limit: break
+                ref_id = _text(m.group(1), enc)
+                links.append((ref_id, _text(m.group(2), enc)))
+                wanted.add(ref_id)
+            if wanted:
+                for m in ANCHOR_RE.finditer(window):
+                    if m.start() >= limit: break
+                    key = m.group(1).decode(enc, 'ignore')
+                    if key in wanted and key not in anchors: anchors[key] = base + m.start()
+            found = []
+            for m in HEADING_RE.finditer(window):
+                if m.start() >= limit: break
+                t = _text(m.group(2), enc)
+                if 1 < len(t) < 60: found.append((base + m.start(), t))
+            headings.extend(found)
+
+            upto = base + limit
+            with self._io_lock:
+                # 书内目录（链接）要扫完才能定位，过程中先按 H 标签增量公开
+                if len(filepos) <= 5 and len(links) <= 5: _add_markers(chapters, offsets, found)
+                self._scan_limit = upto
+            self.invalidate_content() # 末章随扫描变长，已缓存的截断内容作废
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL:
+                callback(task_id, chapters[reported:], upto, 0, False)
+                reported, last_report = len(chapters), now
+
+        # 锚点出现在链接之前时第一遍没有记录，补扫一遍未定位的
+        missing = wanted - anchors.keys()
+        if len(links) > 5 and missing:
+            anchors.update(self._build_anchor_index(missing))
+        if task.cancelled: return
+
+        # 3. 整理结果：策略 A 锚点法 (大合集常用)，不足时补充策略 B H标签法 (小 MOBI 常用)
+        markers = []
+        for pos, t in filepos:
+            if 2 < len(t) < 80 and pos < size: markers.append((self._align_tag(pos), t))
+        if len(links) > 5 and len(markers) < 5:
+            for ref_id, t in links:
+                if 2 < len(t) < 80 and ref_id in anchors:
+                    markers.append((anchors[ref_id], t))
+        if len(markers) < 5:
+            markers.extend(headings)
+
+        # 排序并去重
+        markers = sorted(list(set(markers)), key=lambda x: x[0])
+
+        chapters, offsets = [], []
+        if not markers:
+            for i in range(0, size, 120000):
+                # 切分点对齐到下一个标签开头，避免切在多字节字符或标签中间
+                k = buf[i:i + 4096].find(b'<') if i else 0
+                pos = i + k
+                if k == -1 or (offsets and pos <= offsets[-1]): continue
+                chapters.append((f"第 {len(chapters) + 1} 部分", pos))
+                offsets.append(pos)
+        else:
+            _add_markers(chapters, offsets, markers)
+
+        with self._io_lock:
+            self.chapters, self.chapter_offsets, self._scan_limit = chapters, offsets, None
+        self.invalidate_content()
+        # 完成时界面会按 self.chapters 重建目录，这里传完整列表
+        callback(task_id, chapters, size, 0, True)
+
+    def load_content(self, index):
         try:
-            with open(self.html_path, 'r', encoding='utf-8', errors='ignore') as f:
-                f.seek(start)
-                # 限制读取量，单章 500KB 足够，且 BeautifulSoup 处理这个量级极快
-                chunk = f.read(500000 if end == -1 else min(500000, end - start + 2000))
-                
-                # 使用 BeautifulSoup 进行精准清洗（仅处理当前片段，不卡顿）
-                soup = BeautifulSoup(chunk, 'html.parser')
-                
-                # 移除样式和脚本
-                for s in soup(['style', 'script']): s.decompose()
-                
-                blocks = []
-                # 遍历所有可能的正文和图片标签
-                for tag in soup.find_all(['p', 'div', 'img', 'h1', 'h2', 'h3', 'image']):
-                    if tag.name in ['img', 'image']:
-                        img_data = self._process_img_tag(tag)
-                        if img_data: blocks.append(img_data)
-                    else:
-                        # 仅提取没有子段落标签的文本，防止内容重复提取
-                        if not tag.find(['p', 'div']):
-                            txt = tag.get_text().strip()
-                            if txt and len(txt) > 1:
-                                # 彻底过滤残留的 CSS 样式代码
-                                if '{' in txt and '}' in txt: continue
-                                blocks.append({'type': 'text', 'content': txt})
-                
-                # 兜底方案：如果 BS4 没解析出东西，说明 HTML 严重损坏
-                if not blocks:
-                    clean = re.sub(r'<[^>]+>', '\n', chunk)
-                    for line in clean.split('\n'):
-                        if line.strip(): blocks.append({'type': 'text', 'content': line.strip()})
-                
-                return blocks
+            # 偏移是准确的字节位置，只读本章的字节区间
+            with self._io_lock:
+                if self._buf is None or index >= len(self.chapter_offsets): return []
+                start = self.chapter_offsets[index]
+                end = self.chapter_offsets[index+1] if index+1 < len(self.chapter_offsets) else self._scan_limit
+                chunk = self._buf[start:end].decode(self.encoding, errors='ignore')
+            
+            # 单遍流式提取正文和图片；嵌套的 div/p 只按边界切分，不会重复
+            blocks = extract_blocks(chunk, self._process_img_tag, min_len=2, drop_css=True)
+            
+            # 兜底方案：如果解析不出东西，说明 HTML 严重损坏
+            if not blocks:
+                clean = re.sub(r'<[^>]+>', '\n', chunk)
+                for line in clean.split('\n'):
+                    if line.strip(): blocks.append({'type': 'text', 'content': line.strip()})
+            
+            return blocks
         except Exception as e:
             return [{'type': 'text', 'content': f'读取异常: {e}'}]
 
+    def _open_source(self, native=True):
+        """native 为假时跳过内置读取器（读取中途发现它读不了），已打开的读取器一并关闭"""
+        if native:
+            try:
+                book = MobiBook(self.file_path)
+                with self._io_lock:
+                    if not self._closed:
+                        self.book, self._buf, self.encoding = book, book, book.encoding
+                        return
+                book.close()
+                return
+            except Exception as e:
+                print(f"内置 MOBI 读取器不支持此文件，改为完整解包: {e}")
+        else:
+            with self._io_lock:
+                book, self.book, self._buf = self.book, None, None
+            if book: book.close()
+
+        if self.temp_dir is None: self._extract()
+        if self._closed: return
+        self._build_image_index()
+        with self._io_lock:
+            if self._closed or os.path.getsize(self.html_path) == 0: return
+            with open(self.html_path, 'rb') as f:
+                self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _align_tag(self, pos):
+        """偏移若落在标签内部，退回到该标签的 '<'"""
+        head = self._buf[max(0, pos - 1024):pos]
+        lt, gt = head.rfind(b'<'), head.rfind(b'>')
+        return pos - len(head) + lt if lt > gt else pos
+
+    def _extract(self):
+        if mobi is None: raise ValueError("此文件需要完整解包，请安装 mobi 库")
+        key = fingerprint(self.file_path)
+        hit = self.extract_cache.load(key)
+        if hit:
+            with self._io_lock:
+                if not self._closed: self.temp_dir, self.html_path = hit
+            return
+
+        temp_dir, html_path = mobi.extract(self.file_path)
+        # 寻找最大的内容文件（通常是正文）
+        candidates = []
+        for root, dirs, files in os.walk(temp_dir):
+            for f in files:
+                if f.endswith(('.xhtml', '.html')):
+                    candidates.append(os.path.join(root, f))
+        if candidates:
+            html_path = max(candidates, key=os.path.getsize)
+
+        stored = self.extract_cache.store(key, temp_dir, html_path)
+        with self._io_lock:
+            if not self._closed:
+                if stored:
+                    self.temp_dir, self.html_path = stored
+                else:
+                    self.temp_dir, self.html_path, self._owns_temp = temp_dir, html_path, True
+                return
+        # 解包期间解析器已被关闭：未进缓存的解压目录没有人会再清理，在这里删除
+        if not stored: shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _build_anchor_index(self, wanted):
+        """单遍扫描整个正文，返回 {id/name: 字节偏移}；只保留目录链接引用到的锚点，控制内存"""
+        anchors = {}
+        if not wanted or self._buf is None: return anchors
+        for base, window in _iter_windows(self._buf):
+            for m in ANCHOR_RE.finditer(window):
+                key = m.group(1).decode(self.encoding, 'ignore')
+                if key in wanted and key not in anchors:
+                    anchors[key] = base + m.start()
+        return anchors
+
+    def _build_image_index(self):
+        images, names, recs = {}, {}, {}
+        for root, dirs, files in os.walk(self.temp_dir):
+            for f in sorted(files):
+                if not f.lower().endswith(IMAGE_EXTS): continue
+                full = os.path.join(root, f)
+                rel = os.path.relpath(full, self.temp_dir).replace(os.sep, '/')
+                images[rel.lower()] = full
+                names.setdefault(f.lower(), full)
+                # 旧版 MOBI 的图片按记录号命名（image00001.jpeg），对应标签里的 recindex="00001"
+                m = re.search(r'(\d+)$', os.path.splitext(f)[0])
+                if m: recs.setdefault(int(m.group(1)), full)
+        self.images, self.image_names, self.image_recs = images, names, recs
+
     def _process_img_tag(self, tag):
-        """精准提取图片二进制数据"""
-        # MOBI 常见的图片属性名
-        src = tag.get('src') or tag.get('recindex') or tag.get('xlink:href')
+        """通过扫描时建立的图片索引定位图片；tag 为图片标签的属性字典"""
+        # 旧版 MOBI：<img recindex="00001">，内置读取器直接取对应的图片记录
+        rec = str(tag.get('recindex') or '')
+        if rec.isdigit() and self.book:
+            return self._img_block(self.book.image(int(rec)))
+        if rec.isdigit() and int(rec) in self.image_recs:
+            return self._read_img(self.image_recs[int(rec)])
+        if self.book: return None
+
+        src = str(tag.get('src') or tag.get('xlink:href') or tag.get('href') or '')
         if not src: return None
-        
-        # 清理路径
-        clean_src = str(src).split('/')[-1].replace('../', '').replace('./', '')
-        
-        # 构建搜索范围 (涵盖 KF8 和旧版 MOBI 提取后的所有可能位置)
-        search_dirs = [
-            os.path.dirname(self.html_path),
-            os.path.join(self.temp_dir, 'mobi8', 'OEBPS', 'Images'),
-            os.path.join(self.temp_dir, 'mobi8', 'OEBPS'),
-            os.path.join(self.temp_dir, 'mobi7', 'Images'),
-            self.temp_dir
-        ]
-        
-        # 尝试匹配文件名
-        for d in search_dirs:
-            if not os.path.exists(d): continue
-            # 1. 直接匹配
-            p = os.path.join(d, clean_src)
-            if os.path.exists(p) and os.path.isfile(p):
-                return self._read_img(p)
-            
-            # 2. 模糊匹配（忽略大小写和后缀差异，处理 recindex="00001" 这种）
-            for f in os.listdir(d):
-                if clean_src.lower() in f.lower() or f.lower() in clean_src.lower():
-                    return self._read_img(os.path.join(d, f))
-        return None
+        if src.startswith('kindle:embed:'):
+            # KF8 未改写的引用：kindle:embed:XXXX 为 32 进制的图片序号
+            try:
+                path = self.image_recs.get(int(src[13:].split('?')[0], 32))
+                return self._read_img(path) if path else None
+            except ValueError:
+                return None
+
+        # 相对当前 HTML 解析路径，找不到再按文件名兜底
+        html_dir = os.path.relpath(os.path.dirname(self.html_path), self.temp_dir).replace(os.sep, '/')
+        target = resolve_href('' if html_dir == '.' else html_dir, src)
+        path = self.images.get(target.lower()) or self.image_names.get(target.rsplit('/', 1)[-1].lower())
+        return self._read_img(path) if path else None
 
     def _read_img(self, path):
         try:
             with open(path, 'rb') as f:
-                data = f.read()
-                if len(data) > 100: # 过滤掉损坏的极小图片
-                    return {'type': 'img', 'content': data}
+                return self._img_block(f.read())
         except: pass
         return None
+
+    def _img_block(self, data):
+        if data and len(data) > 100: # 过滤掉损坏的极小图片
+            return {'type': 'img', 'content': data}
+        return None
+
+    def close(self):
+        super().close()
+        with self._io_lock:
+            self._closed = True
+            if self._buf is not None:
+                self._buf.close()
+                self._buf, self.book = None, None
+        if self._owns_temp and self.temp_dir:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir, self._owns_temp = None, False
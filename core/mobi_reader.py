@@ -0,0 +1,160 @@
+import mmap
+import struct
+import threading
+from collections import OrderedDict
+
+# 解压后的文本记录缓存条数（每条通常 4KB）
+RECORD_CACHE_SIZE = 512
+NO_INDEX = 0xFFFFFFFF
+
+
+class RecordSizeError(ValueError):
+    """文本记录解压后的长度与头部记录的名义长度不符，偏移无法按记录换算"""
+
+
+def palmdoc_decompress(data):
+    """PalmDOC (LZ77 变体) 解压"""
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        c = data[i]
+        i += 1
+        if 1 <= c <= 8:
+            out += data[i:i + c]
+            i += c
+        elif c < 0x80:
+            out.append(c)
+        elif c >= 0xC0:
+            out.append(0x20)
+            out.append(c ^ 0x80)
+        elif i < n:
+            c = (c << 8) | data[i]
+            i += 1
+            dist, length = (c >> 3) & 0x7FF, (c & 7) + 3
+            if dist == 0: continue
+            start = len(out) - dist
+            if dist >= length:
+                out += out[start:start + length]
+            else:
+                for k in range(length): # 重叠复制只能逐字节
+                    out.append(out[start + k])
+    return bytes(out)
+
+
+def _trailing_entry_size(data):
+    num = 0
+    for v in data[-4:]:
+        if v & 0x80: num = 0
+        num = (num << 7) | (v & 0x7f)
+    return num
+
+
+def _trailing_size(data, flags):
+    """文本记录末尾附加数据（多字节标记、索引等）的总长度"""
+    num, size = 0, len(data)
+    test = flags >> 1
+    while test:
+        if test & 1: num += _trailing_entry_size(data[:size - num])
+        test >>= 1
+    if flags & 1:
+        num += (data[size - num - 1] & 0x3) + 1
+    return num
+
+
+class MobiBook:
+    """PalmDB/MOBI 记录读取器：只解析头部和记录表，文本记录按需解压
+
+    逻辑文本可以像 bytes 一样按切片读取 (book[start:end])，只解压覆盖该区间的记录；
+    图片按 recindex 直接取对应记录。仅支持旧版 MOBI 文本（含 KF8 合并文件中的旧版部分），
+    纯 KF8 (AZW3)、加密和 HUFF/CDIC 压缩的书会在构造时抛出 ValueError，由调用方回退到完整解包；
+    读取中发现记录长度不符时抛出 RecordSizeError，调用方同样应回退。
+    """
+
+    def __init__(self, path):
+        self._fh = open(path, 'rb')
+        try:
+            self._buf = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def _parse(self):
+        buf = self._buf
+        if buf[60:68] not in (b'BOOKMOBI', b'TEXtREAd'): raise ValueError("不是 MOBI/PalmDOC 文件")
+        count, = struct.unpack_from('>H', buf, 76)
+        self.offsets = [struct.unpack_from('>L', buf, 78 + i * 8)[0] for i in range(count)]
+        self.offsets.append(len(buf))
+
+        rec0 = self.record(0)
+        self.compression, self.text_length, self.text_records, self.record_size, crypt = \
+            struct.unpack_from('>HxxLHHH', rec0, 0)
+        if crypt: raise ValueError("加密 (DRM) 的书")
+        self.encoding, self.extra_flags, self.first_image = 'cp1252', 0, NO_INDEX
+
+        if rec0[16:20] == b'MOBI':
+            length, = struct.unpack_from('>L', rec0, 0x14)
+            enc, = struct.unpack_from('>L', rec0, 0x1C)
+            version, = struct.unpack_from('>L', rec0, 0x24)
+            if version >= 8: raise ValueError("KF8 格式")
+            if enc == 65001: self.encoding = 'utf-8'
+            if length >= 0x60: self.first_image, = struct.unpack_from('>L', rec0, 0x6C)
+            if length >= 0xE4 and version >= 5:
+                self.extra_flags, = struct.unpack_from('>H', rec0, 0xF2)
+        # HUFF/CDIC (17480) 等其他压缩交给完整解包
+        if self.compression not in (1, 2): raise ValueError(f"不支持的压缩方式 {self.compression}")
+
+    def record(self, i):
+        return self._buf[self.offsets[i]:self.offsets[i + 1]]
+
+    def __len__(self):
+        return self.text_length
+
+    def text_record(self, n):
+        """第 n 条文本记录（从 0 计）解压后的内容"""
+        with self._lock:
+            data = self._cache.get(n)
+            if data is not None:
+                self._cache.move_to_end(n)
+                return data
+            raw = self.record(n + 1)
+            if self.extra_flags:
+                raw = raw[:len(raw) - _trailing_size(raw, self.extra_flags)]
+            if self.compression == 2:
+                data = palmdoc_decompress(raw)
+            else:
+                data = bytes(raw)
+            # 切片按 偏移 // record_size 定位记录，除末条外每条都必须是名义长度
+            if n < self.text_records - 1 and len(data) != self.record_size:
+                raise RecordSizeError(f"第 {n} 条文本记录长 {len(data)}，应为 {self.record_size}")
+            self._cache[n] = data
+            if len(self._cache) > RECORD_CACHE_SIZE: self._cache.popitem(last=False)
+            return data
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("MobiBook 只支持切片读取")
+        start, end, _ = key.indices(self.text_length)
+        if start >= end: return b""
+        # 记录的名义长度固定（通常 4096），偏移可以直接换算到记录区间
+        first, last = start // self.record_size, (end - 1) // self.record_size
+        parts = [self.text_record(n) for n in range(first, min(last, self.text_records - 1) + 1)]
+        data = b"".join(parts)
+        base = first * self.record_size
+        return data[start - base:end - base]
+
+    def image(self, recindex):
+        """按 recindex（从 1 计）读取图片记录"""
+        if self.first_image == NO_INDEX: return None
+        i = self.first_image + recindex - 1
+        if not 0 <= i < len(self.offsets) - 1: return None
+        return self.record(i)
+
+    def close(self):
+        try:
+            if getattr(self, '_buf', None) is not None: self._buf.close()
+        finally:
+            self._buf = None
+            self._fh.close()
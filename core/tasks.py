@@ -0,0 +1,62 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class DaemonExecutor:
+    """固定数量守护线程的执行器
+
+    与 ThreadPoolExecutor 用法一致（submit 返回 Future），但工作线程是守护线程，
+    关闭程序时不会因为一本大书还没扫完而卡住退出。
+    """
+
+    def __init__(self, workers, name):
+        self._queue = queue.SimpleQueue()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, fn, *args):
+        fut = Future()
+        self._queue.put((fut, fn, args))
+        return fut
+
+    def _worker(self):
+        while True:
+            fut, fn, args = self._queue.get()
+            if not fut.set_running_or_notify_cancel(): continue # 排队期间已被取消
+            try:
+                fut.set_result(fn(*args))
+            except BaseException as e:
+                fut.set_exception(e)
+
+
+class ScanTask:
+    """可取消的扫描任务句柄
+
+    取消是协作式的：排队中的任务直接丢弃，运行中的任务在检查 cancelled 时自行退出。
+    """
+
+    def __init__(self):
+        self._cancel = threading.Event()
+        self.future = None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future: self.future.cancel()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+# 所有解析器共享：目录扫描最多同时运行两个，章节预取单独一个线程
+SCAN_EXECUTOR = DaemonExecutor(2, "scan")
+PREFETCH_EXECUTOR = DaemonExecutor(1, "prefetch")
+# 插图解码/缩放：线程数固定，图片再多也只是排队
+IMAGE_EXECUTOR = DaemonExecutor(2, "image")
@@ -1,74 +1,636 @@
-import re, threading
-from .base_parser import BaseParser
-from utils.detector import detect_encoding
+import os, re, math, mmap, time, codecs, shutil, tempfile, threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from .base_parser import BaseParser, PROGRESS_INTERVAL
+from .edit_buffer import PieceTable, EditJournal
+from utils.detector import detect_encoding, count_chinese_chars, count_han_utf8
+from utils.index_cache import IndexCache
+
+# 超过该大小的文件改用只读内存映射，常驻内存只跟随实际访问到的页面
+MMAP_THRESHOLD = 32 * 1024 * 1024
+# Windows 上被映射的文件无法被替换，合并写回前必须先释放映射
+UNMAP_BEFORE_REPLACE = os.name == 'nt'
+# 合并写回要重写整本书：编辑日志或片段数超过阈值时才立即合并，
+# 否则等停止编辑 COMPACT_IDLE_DELAY 秒后、扫描前或关闭时再合并
+COMPACT_JOURNAL_BYTES = 16 * 1024 * 1024
+COMPACT_MAX_PIECES = 256
+COMPACT_IDLE_DELAY = 60
+
+
+# 扫描时每次解码的块大小，块边界总是对齐到换行
+SCAN_BLOCK = 4 * 1024 * 1024
+# 片段表没有缓冲区接口，查找块边界的换行时每次读取这么多字节
+EOL_WINDOW = 64 * 1024
+
+# 超过该大小且为多核机器时启用多进程分段扫描，每段交给一个工作进程
+PARALLEL_THRESHOLD = 128 * 1024 * 1024
+PARALLEL_CHUNK = 32 * 1024 * 1024
+
+# 规则匹配不到标题的长段落按此大小（字节）切成虚拟章节，0 表示不切分；
+# 切点只取决于文件内的绝对位置：目标为该大小的整数倍，落在附近的空行处，找不到空行则取其后的换行。
+# 离前后章节起点不足 1/VIRTUAL_SLACK 大小的切点不要，避免切出很短的章节
+VIRTUAL_SLACK = 16
+VIRTUAL_CHAPTER_SIZE = 256 * 1024
+VIRTUAL_TITLE = "〔自动分段〕"
+# 章节规则无效时改用的规则：不匹配任何行，全书只按大小切成虚拟章节
+NO_HEADING_RULE = r'(?!)'
+
+# 换行与 bytes.splitlines 一致：\r\n、\n 或单独的 \r（老式 Mac 文本）
+_EOL_RE = re.compile(rb'\r\n?|\n')
+# 单独的 \r；查找前换成等长的 \n，多行正则的 ^ 就能认出这种行首
+_LONE_CR_RE = re.compile(r'\r(?!\n)')
+_BLANK_RE = re.compile(rb'\n\r?\n|\r\r')
+
+# 规则开头的全局行内标志，如 (?i)
+_GLOBAL_FLAGS_RE = re.compile(r'((?:\(\?[aiLmsux]+\))*)(.*)', re.S)
+
+_process_pool = None
+
+# 同一本书可能同时被多个解析器打开（如保存后关闭、随即重新打开）：
+# 合并写回与日志重放按文件路径串行，避免新解析器读到替换到一半的文件或已作废的日志
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def _path_lock(path):
+    key = os.path.normcase(os.path.abspath(path))
+    with _path_locks_guard:
+        lock = _path_locks.get(key)
+        if lock is None:
+            lock = _path_locks[key] = threading.Lock()
+        return lock
+
+
+def _compile_rule(rule):
+    """返回 (块内查找用的多行正则, 逐行校验用的原始正则)"""
+    reg = re.compile(rule)
+    # 开头的全局标志 (?i) 等必须留在最前面，包裹到 (?:...) 里会编译失败
+    flags, body = _GLOBAL_FLAGS_RE.match(rule).groups()
+    try:
+        finder = re.compile(r'%s^(?:%s)' % (flags, body), re.M)
+    except re.error:
+        # 其他无法包裹的规则：退化为全文多行查找 + 逐行校验
+        finder = re.compile(rule, re.M)
+    return finder, reg
+
+
+def _scan_codec(encoding):
+    """块解码使用的编解码器；BOM 只在文件开头出现，按块处理时用普通 utf-8"""
+    try:
+        name = codecs.lookup(encoding or 'utf-8').name
+    except LookupError:
+        name = 'utf-8'
+    return 'utf-8' if name == 'utf-8-sig' else name
+
+
+def _next_eol(buf, pos, end):
+    """[pos, end) 内第一个换行的结束位置；buf 可以是片段表，此时按窗口读取查找"""
+    if not isinstance(buf, PieceTable):
+        m = _EOL_RE.search(buf, pos, end)
+        return None if m is None else m.end()
+    while pos < end:
+        # 多读一个字节，窗口末尾的 \r 后面是否跟着 \n 也能看到
+        window = buf[pos:min(pos + EOL_WINDOW + 1, end)]
+        m = _EOL_RE.search(window)
+        if m and (m.start() < EOL_WINDOW or pos + len(window) == end):
+            return pos + m.end()
+        pos += EOL_WINDOW
+    return None
+
+
+def _iter_blocks(buf, start, end, size=SCAN_BLOCK):
+    """把 [start, end) 切成按换行对齐的块，只产出偏移"""
+    while start < end:
+        stop = start + size
+        if stop < end:
+            stop = _next_eol(buf, stop, end) or end
+        else:
+            stop = end
+        yield start, stop
+        start = stop
+
+
+def _find_break(data, target, lo, hi, slack):
+    """在 data 的 (lo, hi) 内找 target 附近的切点（行首位置）：优先 ±slack 内的空行，其次其后的换行
+
+    切点总是不早于 target - slack，找不到时返回 None。
+    """
+    a, b = max(lo + 1, target - slack), min(hi - 1, target + slack)
+    if a < b:
+        m = _BLANK_RE.search(data, a, b)
+        if m: return m.start() + 1
+    m = _EOL_RE.search(data, max(lo + 1, target), hi - 1)
+    return m.end() if m else None
+
+
+def _virtual_title(data, pos, codec):
+    """虚拟章节标题：标记 + 切点后第一行非空文字的开头，便于在目录中辨认和搜索"""
+    head = data[pos:pos + 256].decode(codec, errors='ignore')
+    line = next((l.strip() for l in head.splitlines() if l.strip()), "")
+    return VIRTUAL_TITLE + line[:20]
+
+
+def _scan_block(buf, start, end, finder, reg, codec, virtual=0, last=None, closed=None):
+    """扫描一个按行对齐的块，返回 (章节列表, 分段统计)
+
+    整块一次性解码后用多行正则查找，只有命中的行才会被单独取出校验；
+    surrogateescape 保证解码/编码往返时字节数不变，从而能换算出精确的字节偏移。
+    分段统计为 [(字符数, 汉字数), ...]，比章节多一项：首项属于块之前已开始的那一章。
+    virtual > 0 时，长度超过 virtual 的章节在 virtual 的整数倍位置附近切出虚拟章节。
+    last 为块之前最后一章的起点，为 None 表示未知，按该章已经超长处理（见 _scan_parallel）。
+    closed 表示 end 处是下一章起点，默认仅在文件末尾时成立。
+    """
+    data = buf[start:end]
+    text = data.decode(codec, errors='surrogateescape')
+    chapters, cuts = [], [(0, 0)] # 每个章节起点在块内的 (字符位置, 字节位置)
+    pos, char_pos, byte_rel = 0, 0, 0
+    prev = -math.inf if last is None else last
+    # 只用于查找和定位行首行尾，长度与 text 相同，取出的行仍来自 text
+    lines = _LONE_CR_RE.sub('\n', text) if text.count('\r') != text.count('\r\n') else text
+
+    def _split_until(limit_rel, closed):
+        # 在当前章节内、limit_rel 之前的每个网格点附近插入虚拟章节；
+        # closed 表示 limit_rel 是下一章起点或文件末尾，离它太近的切点不要
+        nonlocal char_pos, byte_rel, prev
+        slack = virtual // VIRTUAL_SLACK
+        k = (start + byte_rel) // virtual + 1
+        while k * virtual < start + limit_rel:
+            cut = _find_break(data, k * virtual - start, byte_rel, limit_rel, slack)
+            if cut is None: return
+            k = max(k + 1, (start + cut) // virtual + 1)
+            if start + cut - prev <= slack: continue
+            if closed and limit_rel - cut <= slack: return
+            char_pos += len(data[byte_rel:cut].decode(codec, errors='surrogateescape'))
+            byte_rel, prev = cut, start + cut
+            chapters.append((_virtual_title(data, cut, codec), prev))
+            cuts.append((char_pos, byte_rel))
+
+    while True:
+        m = finder.search(lines, pos)
+        if not m: break
+        ls = lines.rfind('\n', 0, m.start()) + 1
+        le = lines.find('\n', m.start())
+        le = len(text) if le == -1 else le + 1
+        line = text[ls:le]
+        if reg.match(line):
+            seg = len(text[char_pos:ls].encode(codec, errors='surrogateescape'))
+            if virtual and start + byte_rel + seg - prev > virtual:
+                _split_until(byte_rel + seg, True)
+                seg = len(text[char_pos:ls].encode(codec, errors='surrogateescape'))
+            byte_rel += seg
+            char_pos = ls
+            if start + byte_rel != 0:
+                title = line.strip().encode('utf-8', errors='ignore').decode('utf-8')
+                chapters.append((title, start + byte_rel))
+                cuts.append((ls, byte_rel))
+                prev = start + byte_rel
+        pos = le
+    if virtual and end - prev > virtual:
+        # 章节延续到块外：到块尾已经超长的才切，未超长的部分留给后续的块
+        _split_until(len(data), end == len(buf) if closed is None else closed)
+    cuts.append((len(text), len(data)))
+
+    # UTF-8 直接在原始字节上计数，其他编码转成 UTF-8 再计数，结果都是精确值
+    segs = []
+    for (c0, b0), (c1, b1) in zip(cuts, cuts[1:]):
+        han = count_han_utf8(data[b0:b1]) if codec == 'utf-8' else count_chinese_chars(text[c0:c1])
+        segs.append((c1 - c0, han))
+    return chapters, segs
+
+
+def _merge_segments(stats, segs):
+    """把分段统计并入每章统计：首段累加到当前最后一章，其余各段对应新章节"""
+    c, h = stats[-1]
+    stats[-1] = (c + segs[0][0], h + segs[0][1])
+    stats.extend(segs[1:])
+
+
+def _scan_range(path, encoding, rule, blocks, virtual=0):
+    """进程池工作函数：自行映射文件并依次扫描 blocks，与主进程之间只传递偏移和结果
+
+    返回每块的 (章节列表, 分段统计)。段内不知道上一章起点，扫到段内第一章之前按未知处理；
+    虚拟切点只取决于绝对位置，这部分结果由主进程拼接时按真实的上一章起点核对。
+    """
+    finder, reg = _compile_rule(rule)
+    codec = _scan_codec(encoding)
+    results, last = [], None
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for s, e in blocks:
+            found, segs = _scan_block(buf, s, e, finder, reg, codec, virtual, last)
+            if found: last = found[-1][1]
+            results.append((found, segs))
+    return results
+
+
+def _worker_split_matches(found, end, last, worker_last, virtual):
+    """工作进程按未知上一章起点扫出的块，切分是否与真实的上一章起点 last 一致
+
+    未知起点视为章节已经超长：块内第一个标题（或块尾）之前没切出虚拟章节，说明那里本来就切不出；
+    切出了的，只有真实章节同样超长、且第一个切点离 last 足够远时才一致。
+    """
+    if worker_last is not None: return False
+    lead = 0
+    while lead < len(found) and found[lead][0].startswith(VIRTUAL_TITLE):
+        lead += 1
+    if not lead: return True
+    limit = found[lead][1] if lead < len(found) else end
+    return limit - last > virtual and found[0][1] - last > virtual // VIRTUAL_SLACK
+
+
+def _get_process_pool():
+    """全局共享的扫描进程池，首次使用时才创建；留一个核心给 UI 线程"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) - 1))
+    return _process_pool
+
+
+def _discard_process_pool():
+    """进程池损坏后丢弃，下次使用时重建"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
 
 class TxtParser(BaseParser):
     def __init__(self, file_path):
         super().__init__(file_path)
-        with open(file_path, 'rb') as f:
-            self.file_bytes = f.read()
+        self._fh = None
+        # 上次异常退出时未合并的编辑，重放到片段表中，首次扫描前会先合并写盘；
+        # 打开文件到重放日志期间不能插入其他解析器对同一本书的合并写回
+        self._path_lock = _path_lock(file_path)
+        self.journal = EditJournal(file_path)
+        with self._path_lock:
+            self.file_bytes = self._open_buffer()
+            # 读取走片段表；_io_lock 保护片段表/缓冲区的切换，
+            # _base_lock 在扫描或合并期间长时间持有，保证原文件缓冲区不会被中途替换
+            self.doc = PieceTable(self.file_bytes)
+            self._replay_journal()
         self.encoding = detect_encoding(self.file_bytes[:30000])
-        self.is_running = False # 任务运行标志
+        self.index_cache = IndexCache()
+        # 最近一次完整索引所用的规则及统计，保存编辑后据此做增量修补
+        self.rule = None
+        # 索引经过编辑后的增量修补：虚拟切分与完整扫描不完全一致，不写入磁盘缓存
+        self._index_patched = False
+        self.total_chars, self.total_han = 0, 0
+        self.virtual_size = VIRTUAL_CHAPTER_SIZE
+        # 扫描进行中已确定的字节上限；末章在扫描完成前不会越过它
+        self._scan_limit = None
+
+        self._io_lock = threading.RLock()
+        self._base_lock = threading.Lock()
+        self._closed = False
+        self._compact_timer = None
+        # 后台合并写回失败时的通知 on_error(消息)，在工作线程中调用，由界面设置
+        self.on_error = None
+
+    def _open_buffer(self):
+        """小文件直接读入；大文件使用 mmap，打开耗时与文件大小无关"""
+        if os.path.getsize(self.file_path) >= MMAP_THRESHOLD:
+            self._fh = open(self.file_path, 'rb')
+            return mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.file_path, 'rb') as f:
+            return f.read()
+
+    def _replay_journal(self):
+        for start, end, data in self.journal.replay():
+            self.doc.replace(start, end, data)
+
+    def _release_buffer(self):
+        if isinstance(self.file_bytes, mmap.mmap):
+            self.file_bytes.close()
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+        self.file_bytes = b""
+        self.doc = PieceTable(self.file_bytes)
+
+    @contextmanager
+    def _hold_base(self):
+        """独占原文件缓冲区；期间若解析器被关闭，由持有者负责释放"""
+        with self._base_lock:
+            try:
+                yield
+            finally:
+                if self._closed:
+                    with self._io_lock: self._release_buffer()
 
 
     def scan(self, rule, callback, task_id):
-        self.is_running = True 
-        
-        def _work():
-            chapters = [("正文开始", 0)]
-            total_chars, total_han = 0, 0
-            
+        self.rule = None # 扫描完成前索引不完整，不允许增量修补
+        return super().scan(rule, callback, task_id)
+
+    def run_scan(self, rule, callback, task_id, task):
+        with self._hold_base():
+            if self._closed or task.cancelled: return
+            # 扫描只读原文件，先把未合并的编辑写回磁盘
             try:
-                import re
-                reg = re.compile(rule)
-            except:
-                # 线程内最后的防线：如果编译失败，告知UI索引已完成（空结果）
-                self.chapters = chapters
+                self._compact_locked()
+            except Exception as e:
+                # 写回失败（文件被占用、目录只读等）：编辑仍在日志里，改为扫描片段表，照常给出目录
+                self._report_error(f"编辑尚未写回原文件，将在下次保存或解析时重试: {e}")
+            self._scan_locked(rule, callback, task_id, task)
+
+    def _report_error(self, message):
+        print(message)
+        if self.on_error: self.on_error(message)
+
+    def _scan_source(self):
+        """扫描读取的内容：没有未合并的编辑时是原文件缓冲区，否则是片段表的快照"""
+        with self._io_lock:
+            return self.doc.snapshot() if self.doc.dirty else self.file_bytes
+
+    def _scan_locked(self, rule, callback, task_id, task):
+        source = self._scan_source()
+        # 磁盘索引对应磁盘上的文件，扫描未合并的编辑时既不读取也不写入
+        cacheable = not isinstance(source, PieceTable)
+        # 同一文件、同一规则扫描过则直接复用磁盘索引，不再读取正文
+        cached = cacheable and self.index_cache.load(self.file_path, self._index_key(rule), self.encoding)
+        if cached and not task.cancelled:
+            self._set_index(rule, *cached)
+            callback(task_id, self.chapters, self.total_chars, self.total_han, True)
+            return
+
+        chapters, stats = [("正文开始", 0)], [(0, 0)]
+        total_chars, total_han = 0, 0
+
+        try:
+            finder, reg = _compile_rule(rule)
+        except:
+            # 线程内最后的防线：规则编译失败时不找标题，全书只按大小切虚拟章节，
+            # 超大的书也不会成为一整章；规则无效，之后的编辑不做增量修补，结果也不写入索引缓存
+            if not self.virtual_size:
+                # 不切分：告知UI索引已完成（全文一章），旧目录的缓存内容和扫描上限一并作废
+                self._set_index(None, chapters, stats)
                 callback(task_id, chapters, 0, 0, True)
                 return
+            rule = None
+            finder, reg = _compile_rule(NO_HEADING_RULE)
+
+        # 目录边扫边公开，界面可以实时显示并点击已扫到的章节
+        if task.cancelled: return
+        with self._io_lock:
+            self.chapters, self.chapter_stats, self._scan_limit = chapters, stats, 0
+            self.invalidate_content()
+        reported, last_report = 0, time.monotonic()
 
+        def _emit(found, segs, upto):
+            nonlocal total_chars, total_han, reported, last_report
+            if task.cancelled: return
+            with self._io_lock:
+                chapters.extend(found)
+                _merge_segments(stats, segs)
+                self._scan_limit = upto
+                self.invalidate_content() # 末章随扫描变长，已缓存的截断内容作废
+            total_chars += sum(c for c, _ in segs)
+            total_han += sum(h for _, h in segs)
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL:
+                callback(task_id, chapters[reported:], total_chars, total_han, False)
+                reported, last_report = len(chapters), now
 
-            lines = self.file_bytes.splitlines(keepends=True)
-            curr_pos = 0
-            
-            for i, line_byte in enumerate(lines):
-                if not self.is_running: return # 收到停止信号，退出线程
-                
+        finished = None
+        try:
+            if cacheable and self._use_parallel():
                 try:
-                    line_str = line_byte.decode(self.encoding, errors='ignore')
-                    if reg.match(line_str):
-                        if curr_pos != 0: chapters.append((line_str.strip(), curr_pos))
-                    
-                    total_chars += len(line_str)
-                    if i % 10 == 0:
-                        total_han += len(re.findall(r'[\u4e00-\u9fff]', line_str))
-                except: pass
-                
-                curr_pos += len(line_byte)
-                if i % 8000 == 0:
-                    callback(task_id, list(chapters), total_chars, total_han, False)
-            
-            self.chapters = chapters
-            callback(task_id, chapters, total_chars, total_han, True)
-
-        threading.Thread(target=_work, daemon=True).start()
-
-    def stop_scan(self):
-        self.is_running = False
-
-
-    def get_content(self, idx):
-        if not self.chapters: return ""
+                    finished = self._scan_parallel(rule or NO_HEADING_RULE, finder, reg, _emit, task)
+                except Exception as e:
+                    # 进程池不可用（打包环境、权限等）时回退到单线程扫描
+                    print(f"并行扫描失败，回退单线程: {e}")
+                    _discard_process_pool()
+                    with self._io_lock:
+                        del chapters[1:]
+                        stats[:] = [(0, 0)]
+                        self._scan_limit = 0
+                        self.invalidate_content()
+                    total_chars, total_han = 0, 0
+                    # 已回传的章节作废：让界面清空目录，之后从头增量回传
+                    reported, last_report = 0, time.monotonic()
+                    callback(task_id, None, 0, 0, False)
+            if finished is None:
+                finished = self._scan_serial(source, finder, reg, _emit, task)
+        except Exception as e:
+            if task.cancelled: return # 解析器被关闭等导致的中断，结果作废
+            # 读取出错（IO、缓冲区失效等）：保留已扫到的部分并结束扫描，否则扫描上限不会清除，
+            # 界面一直停在解析中，也无法保存编辑；规则视为无效，之后的编辑不做增量修补
+            self._report_error(f"目录解析出错，只显示已解析的部分: {e}")
+            with self._io_lock:
+                del chapters[len(stats):] # _emit 中途出错时章节可能比统计多
+            self._set_index(None, chapters, stats)
+            callback(task_id, chapters[reported:], self.total_chars, self.total_han, True)
+            return
+        if not finished or task.cancelled: return # 任务已被取消，结果作废
+
+        self._set_index(rule, chapters, stats)
+        callback(task_id, chapters[reported:], total_chars, total_han, True)
+        if cacheable and rule is not None:
+            self.index_cache.store(self.file_path, self._index_key(rule), self.encoding, chapters, stats)
+
+    def _index_key(self, rule):
+        # 虚拟章节大小也影响结果，一并计入索引缓存的键
+        return f"{rule}\0{self.virtual_size}" if self.virtual_size else rule
+
+    def _set_index(self, rule, chapters, chapter_stats, patched=False):
+        with self._io_lock:
+            self.chapters, self.chapter_stats, self.rule = chapters, chapter_stats, rule
+            self._index_patched = patched
+            self._scan_limit = None
+            self.invalidate_content()
+        self.total_chars = sum(c for c, _ in chapter_stats)
+        self.total_han = sum(h for _, h in chapter_stats)
+
+    def _use_parallel(self):
+        return (isinstance(self.file_bytes, mmap.mmap)
+                and len(self.file_bytes) >= PARALLEL_THRESHOLD
+                and (os.cpu_count() or 1) > 1)
+
+    def _scan_serial(self, buf, finder, reg, emit, task):
+        codec = _scan_codec(self.encoding)
+        last = 0
+        for start, end in _iter_blocks(buf, 0, len(buf)):
+            if task.cancelled: return False
+            found, segs = _scan_block(buf, start, end, finder, reg, codec, self.virtual_size, last)
+            if found: last = found[-1][1]
+            emit(found, segs, end)
+        return True
+
+    def _scan_parallel(self, rule, finder, reg, emit, task):
+        """按行对齐切段并行扫描，结果按文件顺序拼接回来
+
+        每段由若干个与单线程扫描相同的块组成。虚拟切点只取决于绝对位置，上一章起点只决定章节是否超长、
+        以及丢弃离它太近的切点。工作进程不知道段首之前的上一章起点，拼接时用 _worker_split_matches
+        按真实起点核对段内第一章之前的切分，对不上的块在主进程里重扫，结果与单线程扫描完全一致。
+        """
+        buf, codec, virtual = self.file_bytes, _scan_codec(self.encoding), self.virtual_size
+        blocks = list(_iter_blocks(buf, 0, len(buf)))
+        step = max(PARALLEL_CHUNK // SCAN_BLOCK, 1)
+        ranges = [blocks[i:i + step] for i in range(0, len(blocks), step)]
+        pool = _get_process_pool()
+        futures = [pool.submit(_scan_range, self.file_path, self.encoding, rule, r, virtual) for r in ranges]
+        last = 0
+        try:
+            for fut, r in zip(futures, ranges):
+                if task.cancelled: return False
+                worker_last = None # 工作进程扫描当前块时使用的上一章起点，None 为未知
+                for (start, end), result in zip(r, fut.result()):
+                    found, segs = result
+                    if virtual and last != worker_last and not _worker_split_matches(found, end, last, worker_last, virtual):
+                        # 切分与真实的上一章起点对不上：在主进程里重扫这一块
+                        if task.cancelled: return False
+                        found, segs = _scan_block(buf, start, end, finder, reg, codec, virtual, last)
+                    if result[0]: worker_last = result[0][-1][1]
+                    emit(found, segs, end)
+                    if found: last = found[-1][1]
+        finally:
+            for fut in futures: fut.cancel()
+        return True
+
+    def close(self):
+        super().close()
+        self._closed = True
+        if self._compact_timer: self._compact_timer.cancel()
+        if self.doc.dirty:
+            # 还有编辑未写回：交给合并线程写完后再释放
+            self._schedule_compact()
+        elif self._base_lock.acquire(blocking=False):
+            try:
+                with self._io_lock: self._release_buffer()
+            finally:
+                self._base_lock.release()
+        # 否则正在扫描/合并的线程结束时会负责释放
+
+
+    def _chapter_range(self, idx):
         start = self.chapters[idx][1]
-        end = self.chapters[idx+1][1] if idx+1 < len(self.chapters) else len(self.file_bytes)
-        raw = self.file_bytes[start:end].decode(self.encoding, errors='ignore').replace('\r\n', '\n')
+        if idx + 1 < len(self.chapters):
+            return start, self.chapters[idx+1][1]
+        return start, (len(self.doc) if self._scan_limit is None else self._scan_limit)
+
+    def load_content(self, idx):
+        if not self.chapters: return ""
+        with self._io_lock:
+            start, end = self._chapter_range(idx)
+            data = self.doc[start:end]
+        raw = data.decode(self.encoding, errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
         return "\n".join([l.strip() for l in raw.split('\n')])
 
     def save_content(self, idx, content):
+        """保存只追加编辑日志并更新片段表，正文由后台线程合并写回
+
+        扫描进行中拒绝保存：末章还没扫完，显示出来的只是其中一截，按最终范围替换会删掉其余部分。
+        """
         new_bytes = (content.strip() + "\n\n").encode(self.encoding, errors='ignore')
-        start = self.chapters[idx][1]
-        end = self.chapters[idx+1][1] if idx+1 < len(self.chapters) else len(self.file_bytes)
-        self.file_bytes = self.file_bytes[:start] + new_bytes + self.file_bytes[end:]
-        with open(self.file_path, 'wb') as f:
-            f.write(self.file_bytes)
+        with self._io_lock:
+            if self._scan_limit is not None:
+                raise RuntimeError("目录正在解析，解析完成后才能保存")
+            start, end = self._chapter_range(idx)
+            self.journal.append(start, end, new_bytes)
+            self.doc.replace(start, end, new_bytes)
+            if self.rule is not None:
+                self._reindex_edit(idx, start, end, start + len(new_bytes))
+            else:
+                self.invalidate_content()
+        self._request_compact()
         return True
+
+    def _reindex_edit(self, idx, start, old_end, new_end):
+        """重扫上一章起点到编辑结束的字节区间，后续章节整体平移，每章统计随之替换
+
+        从上一章起点扫起，被编辑的章节即使没有标题行（虚拟章节），也能按上一章起点重新切分，
+        而不是整段并入上一章。
+        """
+        finder, reg = _compile_rule(self.rule)
+        first = max(idx - 1, 0)
+        scan_from = self.chapters[first][1] if idx else 0
+        found, segs = _scan_block(self.doc, scan_from, new_end, finder, reg, _scan_codec(self.encoding),
+                                  self.virtual_size, scan_from, idx + 1 < len(self.chapters))
+        if found and found[0][1] == scan_from:
+            segs = segs[1:] # 上一章以标题行开头，被重新找到，其前的空段丢弃
+        else:
+            # 正文开始或虚拟章节：起点不是标题行，原样保留；标题行被删掉时内容随之并入这一章
+            found.insert(0, self.chapters[first])
+        delta = (new_end - start) - (old_end - start)
+        later = [(title, pos + delta) for title, pos in self.chapters[idx+1:]]
+        # 只切分改动附近，之后虚拟章节的位置可能与完整扫描不同；没有虚拟切分时结果一致
+        self._set_index(self.rule, self.chapters[:first] + found + later,
+                        self.chapter_stats[:first] + segs + self.chapter_stats[idx+1:],
+                        self._index_patched or bool(self.virtual_size))
+
+    # --- 后台合并：片段表写入临时文件后原子替换原文件 ---
+    def _request_compact(self):
+        """编辑积累到阈值时立即合并；否则推迟到停止编辑一段时间后，期间每次保存都重新计时"""
+        if self._compact_timer: self._compact_timer.cancel()
+        self._compact_timer = None
+        if self.journal.size() >= COMPACT_JOURNAL_BYTES or len(self.doc.pieces) >= COMPACT_MAX_PIECES:
+            self._schedule_compact()
+            return
+        self._compact_timer = threading.Timer(COMPACT_IDLE_DELAY, self._schedule_compact)
+        self._compact_timer.daemon = True # 退出时由 close() 负责合并
+        self._compact_timer.start()
+
+    def _schedule_compact(self):
+        # 非守护线程：程序退出时也会把正在进行的合并写完
+        threading.Thread(target=self._compact, daemon=False).start()
+
+    def _compact(self):
+        try:
+            with self._hold_base():
+                self._compact_locked()
+        except Exception as e:
+            # 合并失败不丢数据：编辑仍在日志里，下次保存或扫描时重试
+            self._report_error(f"合并编辑失败，编辑仍保留在日志中: {e}")
+
+    def _compact_locked(self):
+        """需持有 _base_lock 调用；同一本书的合并按路径串行，每次写入各自的临时文件"""
+        with self._path_lock:
+            while not self._compact_once():
+                pass # 写盘期间又有新的编辑，重新合并
+
+    def _compact_once(self):
+        """把片段表快照写入临时文件并替换原文件；快照已过期时返回 False"""
+        with self._io_lock:
+            if not self.doc.dirty: return True
+            version, pieces = self.doc.version, list(self.doc.pieces)
+
+        path = os.path.abspath(self.file_path)
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".compact.tmp",
+                                   dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in self.doc.iter_chunks(pieces):
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            shutil.copymode(self.file_path, tmp)
+
+            with self._io_lock:
+                if self.doc.version != version: return False
+                # 替换成功前原缓冲区和片段表保持不动；只有必须先释放映射时才提前释放
+                unmapped = UNMAP_BEFORE_REPLACE and isinstance(self.file_bytes, mmap.mmap)
+                if unmapped: self._release_buffer()
+                try:
+                    os.replace(tmp, self.file_path)
+                except OSError:
+                    if unmapped:
+                        # 原文件未被替换：重新打开并按日志重建片段表，编辑不丢失
+                        self.file_bytes = self._open_buffer()
+                        self.doc = PieceTable(self.file_bytes)
+                        self._replay_journal()
+                    raise
+                self._release_buffer()
+                self.journal.discard()
+                if self._closed: return True
+                self.file_bytes = self._open_buffer()
+                self.doc = PieceTable(self.file_bytes)
+                if self.rule is not None and not self._index_patched:
+                    self.index_cache.store(self.file_path, self._index_key(self.rule), self.encoding,
+                                           self.chapters, self.chapter_stats)
+                return True
+        finally:
+            # 写入、过期或替换失败时临时文件还在，清理掉
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
@@ -1,3 +1,4 @@
+import multiprocessing
 import tkinter as tk
 from ui.app import ReaderApp
 
@@ -16,4 +17,6 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    # 打包后的程序需要它才能正确启动扫描子进程
+    multiprocessing.freeze_support()
     main()
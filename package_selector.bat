@@ -31,10 +31,10 @@ REM 检查是否安装了EPUB和MOBI依赖包（仅模块化版本需要）
 if "%choice%"=="1" (
     echo.
     echo 检查EPUB和MOBI依赖包...
-    python -c "import ebooklib, bs4, mobi" >nul 2>&1
+    python -c "import mobi" >nul 2>&1
     if errorlevel 1 (
         echo 正在安装EPUB和MOBI依赖包...
-        pip install ebooklib beautifulsoup4 mobi
+        pip install mobi
         if errorlevel 1 (
             echo 警告：EPUB/MOBI依赖包安装失败，模块化版本将无法支持EPUB/MOBI格式
         ) else (
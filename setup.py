@@ -7,8 +7,8 @@ include_files = []
 
 
 build_exe_options = {
-    "packages": ["tkinter", "os", "sys", "json", "re", "threading", "time", "ebooklib", "bs4", "mobi"],
-    "excludes": ["tkinter.test", "tkinter.tests", "test", "unittest", "email", "xml", "distutils"],
+    "packages": ["tkinter", "os", "sys", "json", "re", "threading", "time", "xml", "zipfile", "html", "mobi"],
+    "excludes": ["tkinter.test", "tkinter.tests", "test", "unittest", "email", "distutils"],
     "include_files": include_files,
     "optimize": 2,
     "build_exe": "build/NovelReader",  # 使用英文目录名避免路径问题
@@ -0,0 +1,29 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import utils.config as config
+
+
+class AppDirTestCase(unittest.TestCase):
+    """临时程序目录：配置和各类磁盘缓存都落在 self.dir 下，测试结束后整个删除"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.patch(mock.patch.object(config, 'get_app_dir', lambda: self.dir))
+
+    def patch(self, *patches):
+        """启动补丁，测试结束时自动撤销"""
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def write_file(self, name, data):
+        """在临时目录中写入文件，返回其路径"""
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
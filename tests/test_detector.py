@@ -0,0 +1,47 @@
+import re
+import unittest
+
+from utils.detector import count_chinese_chars, count_han_utf8
+
+
+def _reference(text):
+    return len(re.findall('[\u4e00-\u9fff]', text))
+
+
+class CountHanTest(unittest.TestCase):
+    """字节级汉字计数必须与逐字统计完全一致"""
+
+    SAMPLES = [
+        "",
+        "第一章 风起云涌，ABC abc 123。",
+        "\u4e00\u9fff\u4dff\u3400\ua000", # 区间两端及其外侧：Ext-A、彝文
+        "扩展B：\U00020000\U0002a6df，兼容：\uf900",
+        "全角标点：“”‘’「」『』（）！？、；：——……",
+        "日本語のかな、한국어 문장，Ελληνικά",
+        "\u4db5\u4e00" * 50 + "\u4000x",
+    ]
+
+    def test_matches_reference_on_valid_text(self):
+        for text in self.SAMPLES:
+            expected = _reference(text)
+            self.assertEqual(count_chinese_chars(text), expected, text)
+            self.assertEqual(count_han_utf8(text.encode('utf-8')), expected, text)
+
+    def test_invalid_and_truncated_sequences(self):
+        han = "汉字".encode('utf-8')
+        samples = [
+            han[:-1], # 末字截断
+            han[:1] + b"abc", # 孤立的首字节
+            b"\xe4\xb8" + han, # 截断后紧跟完整汉字
+            han + b"\xe5\x80\xe4\xb8\xad", # 续字节不足
+            b"\x80\xbf" + han + b"\xff\xfe", # 孤立续字节与非法字节
+            "表".encode('gbk') + han, # 误判编码的 GBK 字节
+        ]
+        for data in samples:
+            text = data.decode('utf-8', errors='surrogateescape')
+            self.assertEqual(count_han_utf8(data), _reference(text), data)
+            self.assertEqual(count_han_utf8(data), count_chinese_chars(text), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
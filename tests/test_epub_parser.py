@@ -0,0 +1,165 @@
+import os
+import unittest
+import zipfile
+from unittest import mock
+
+import core.epub_parser as epub_parser
+from core.epub_parser import EpubParser
+from core.tasks import ScanTask
+
+from support import AppDirTestCase
+
+OPF = b'''<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <manifest><item id="c1" href="c1.xhtml" media-type="application/xhtml+xml"/></manifest>
+  <spine><itemref idref="c1"/></spine>
+</package>'''
+
+
+class EpubScanCloseTest(AppDirTestCase):
+    """扫描期间换书（解析器被关闭），扫描线程新打开的归档不能泄漏"""
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, "book.epub")
+        with zipfile.ZipFile(self.path, 'w') as zf:
+            zf.writestr("content.opf", OPF)
+            zf.writestr("c1.xhtml", b"<html><body><h1>Chapter</h1><p>text</p></body></html>")
+        self.opened = []
+
+        def tracked(path):
+            archive = real(path)
+            self.opened.append(archive)
+            return archive
+        real = epub_parser.EpubArchive
+        self.patch(mock.patch.object(epub_parser, 'EpubArchive', tracked))
+
+    def test_archive_published_on_success(self):
+        parser = EpubParser(self.path)
+        self.addCleanup(parser.close)
+        parser.run_scan(None, lambda *a: None, 1, ScanTask())
+        self.assertIs(parser.archive, self.opened[0])
+        self.assertIsNotNone(parser.archive.zf.fp)
+
+    def test_archive_closed_when_parser_closed_mid_scan(self):
+        parser = EpubParser(self.path)
+        done = []
+        # 归档打开后、公开前解析器被关闭
+        with mock.patch.object(epub_parser, '_sniff_title', lambda head: parser.close()):
+            parser.run_scan(None, lambda *a: done.append(a), 1, ScanTask())
+        self.assertEqual(done, [])
+        self.assertIsNone(parser.archive)
+        self.assertIsNone(self.opened[0].zf.fp)
+
+    def test_archive_closed_when_cancelled(self):
+        parser = EpubParser(self.path)
+        self.addCleanup(parser.close)
+        task = ScanTask()
+        with mock.patch.object(epub_parser, '_sniff_title', lambda head: task.cancel()):
+            parser.run_scan(None, lambda *a: None, 1, task)
+        self.assertIsNone(parser.archive)
+        self.assertIsNone(self.opened[0].zf.fp)
+
+
+def _opf(version, manifest, spine, toc=""):
+    return f'''<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="{version}">
+  <manifest>{manifest}</manifest>
+  <spine{toc}>{spine}</spine>
+</package>'''.encode()
+
+
+def _chapter(name, head=b""):
+    return b"<html><head>" + head + b"</head><body><p>" + name.encode() + b"</p></body></html>"
+
+
+NAV = """<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops"><body>
+  <nav epub:type="landmarks"><ol><li><a href="text/c2.xhtml">Landmark</a></li></ol></nav>
+  <nav epub:type="toc"><ol>
+    <li><a href="text/c1.xhtml">第一章 <span>开端</span></a>
+      <ol><li><a href="text/c1.xhtml#sec">第一节</a></li></ol></li>
+    <li><a href="text/c2.xhtml#sec2">第二章</a></li>
+  </ol></nav>
+</body></html>""".encode()
+
+NCX = """<?xml version="1.0" encoding="utf-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/"><navMap>
+  <navPoint id="p1"><navLabel><text>卷一</text></navLabel><content src="text/c1.xhtml#vol"/>
+    <navPoint id="p2"><navLabel><text>第一章</text></navLabel><content src="text/c1.xhtml#sec"/></navPoint>
+  </navPoint>
+  <navPoint id="p3"><navLabel><text>第二章</text></navLabel><content src="text/c2.xhtml#sec2"/></navPoint>
+</navMap></ncx>""".encode()
+
+
+class EpubTocTitleTest(AppDirTestCase):
+    """章节标题取自书内目录：EPUB3 nav 优先，其次 NCX；带 #片段 的链接归到所在的 spine 文档"""
+
+    def _scan(self, files):
+        path = os.path.join(self.dir, "book.epub")
+        with zipfile.ZipFile(path, 'w') as zf:
+            zf.writestr("META-INF/container.xml",
+                        b'<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+                        b'<rootfile full-path="OEBPS/content.opf"/></rootfiles></container>')
+            for name, data in files.items():
+                zf.writestr("OEBPS/" + name, data)
+        parser = EpubParser(path)
+        self.addCleanup(parser.close)
+        done = []
+        parser.run_scan(None, lambda *a: done.append(a), 1, ScanTask())
+        self.assertEqual(len(done), 1)
+        return [title for title, i in parser.chapters]
+
+    def test_epub3_nav(self):
+        items = ('<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+                 '<item id="c1" href="text/c1.xhtml" media-type="application/xhtml+xml"/>'
+                 '<item id="c2" href="text/c2.xhtml" media-type="application/xhtml+xml"/>'
+                 '<item id="c3" href="text/c3.xhtml" media-type="application/xhtml+xml"/>')
+        spine = '<itemref idref="c1"/><itemref idref="c2"/><itemref idref="c3"/>'
+        titles = self._scan({
+            "content.opf": _opf("3.0", items, spine),
+            "nav.xhtml": NAV,
+            "text/c1.xhtml": _chapter("one"),
+            "text/c2.xhtml": _chapter("two"),
+            # 目录里没有的文档嗅探 <title>
+            "text/c3.xhtml": _chapter("three", "<title>后记</title>".encode()),
+        })
+        # 同一文档取最先出现的条目，landmarks 导航不算目录
+        self.assertEqual(titles, ["第一章 开端", "第二章", "后记"])
+
+    def test_ncx_only(self):
+        items = ('<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>'
+                 '<item id="c1" href="text/c1.xhtml" media-type="application/xhtml+xml"/>'
+                 '<item id="c2" href="text/C2.xhtml" media-type="application/xhtml+xml"/>'
+                 '<item id="c3" href="text/c3.xhtml" media-type="application/xhtml+xml"/>')
+        spine = '<itemref idref="c1"/><itemref idref="c2"/><itemref idref="c3"/>'
+        titles = self._scan({
+            "content.opf": _opf("2.0", items, spine, ' toc="ncx"'),
+            "toc.ncx": NCX,
+            "text/c1.xhtml": _chapter("one"),
+            # 目录与清单大小写不一致时按归档内实际成员名匹配
+            "text/C2.xhtml": _chapter("two"),
+            "text/c3.xhtml": _chapter("three"),
+        })
+        self.assertEqual(titles, ["卷一", "第二章", "第 3 章节"])
+
+    def test_fragment_href_maps_to_spine_entry(self):
+        items = ('<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+                 '<item id="c1" href="text/c1.xhtml" media-type="application/xhtml+xml"/>'
+                 '<item id="c2" href="text/c2.xhtml" media-type="application/xhtml+xml"/>')
+        nav = """<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops"><body>
+  <nav epub:type="toc"><ol>
+    <li><a href="text/c1.xhtml">第一章</a></li>
+    <li><a href="text/c2.xhtml#sec">第二章</a></li>
+  </ol></nav></body></html>""".encode()
+        titles = self._scan({
+            "content.opf": _opf("3.0", items, '<itemref idref="c1"/><itemref idref="c2"/>'),
+            "nav.xhtml": nav,
+            "text/c1.xhtml": _chapter("one"),
+            "text/c2.xhtml": _chapter("two", "<title>不该用到</title>".encode()),
+        })
+        self.assertEqual(titles, ["第一章", "第二章"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+import core.html_blocks as html_blocks
+from core.html_blocks import extract_blocks
+
+SAMPLE = b'''<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Title</title><style>p { margin: 0 }</style></head>
+<body>
+<h1>Chapter <em>One</em></h1>
+<p>First line<br/>Second <b>bold <i>nested</i></b> line</p>
+<div><p>Inner</p> tail text</div>
+<p>&lt;tag&gt; &amp; &#20013;&#x6587; &quot;quoted&quot; &nbsp;end</p>
+<p><img src="a.jpg" alt="A"/>after image</p>
+<script>var x = 1;</script>
+<svg><image xlink:href="b.png"/></svg>
+<p>x</p>
+</body></html>'''
+
+
+def _resolve(attrs):
+    src = next((v for k, v in attrs.items() if k.rsplit('}', 1)[-1].split(':')[-1] in ('src', 'href')), None)
+    return {'type': 'img', 'content': src} if src else None
+
+
+class ExtractBlocksTest(unittest.TestCase):
+    """lxml 与标准库两套解析路径的输出必须一致"""
+
+    EXPECTED = [
+        {'type': 'text', 'content': 'Chapter One'},
+        {'type': 'text', 'content': 'First line'},
+        {'type': 'text', 'content': 'Second bold nested line'},
+        {'type': 'text', 'content': 'Inner'},
+        {'type': 'text', 'content': 'tail text'},
+        {'type': 'text', 'content': '<tag> & 中文 "quoted" \xa0end'},
+        {'type': 'img', 'content': 'a.jpg'},
+        {'type': 'text', 'content': 'after image'},
+        {'type': 'img', 'content': 'b.png'},
+        {'type': 'text', 'content': 'x'},
+    ]
+
+    def _std(self, markup, **kw):
+        with mock.patch.object(html_blocks, 'etree', None):
+            return extract_blocks(markup, _resolve, **kw)
+
+    def test_stdlib_backend(self):
+        self.assertEqual(self._std(SAMPLE), self.EXPECTED)
+
+    @unittest.skipIf(html_blocks.etree is None, "未安装 lxml")
+    def test_lxml_matches_stdlib(self):
+        self.assertEqual(extract_blocks(SAMPLE, _resolve), self.EXPECTED)
+        fragment = "<p>半截<b>片段</p><p>第二段"
+        self.assertEqual(extract_blocks(fragment), self._std(fragment))
+
+    def test_min_len_and_css_fragment(self):
+        markup = "p.x { color: red }</style><p>x</p><p>正文内容</p>"
+        self.assertEqual(self._std(markup, min_len=2, drop_css=True), [{'type': 'text', 'content': '正文内容'}])
+
+
+if __name__ == "__main__":
+    unittest.main()
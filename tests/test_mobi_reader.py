@@ -0,0 +1,130 @@
+import os
+import struct
+import unittest
+from unittest import mock
+
+from core.mobi_parser import MobiParser
+from core.mobi_reader import MobiBook, RecordSizeError
+from core.tasks import ScanTask
+
+from support import AppDirTestCase
+
+
+def _palmdb(records, text_length, record_size, compression=1, extra_flags=0):
+    """拼一个最小的 PalmDOC 文件：记录 0 为头，其后为文本记录；extra_flags 非零时带 MOBI 头"""
+    rec0 = bytearray(struct.pack('>HxxLHHHxx', compression, text_length, len(records), record_size, 0))
+    if extra_flags:
+        rec0 += bytes(0xF4 - len(rec0))
+        rec0[16:20] = b'MOBI'
+        struct.pack_into('>LxxxxLxxxxL', rec0, 0x14, 0xE4, 65001, 6) # 头长、UTF-8、版本
+        struct.pack_into('>L', rec0, 0x6C, 0xFFFFFFFF) # 没有图片
+        struct.pack_into('>H', rec0, 0xF2, extra_flags)
+    recs = [bytes(rec0)] + records
+    head = bytearray(78)
+    head[60:68] = b'BOOKMOBI' if extra_flags else b'TEXtREAd'
+    struct.pack_into('>H', head, 76, len(recs))
+    pos, table = 78 + 8 * len(recs), b''
+    for r in recs:
+        table += struct.pack('>LL', pos, 0)
+        pos += len(r)
+    return bytes(head) + table + b''.join(recs)
+
+
+def _backref(dist, length):
+    """PalmDOC 回溯引用：向前 dist 字节复制 length (3..10) 字节"""
+    return struct.pack('>H', 0x8000 | (dist << 3) | (length - 3))
+
+
+# 压缩记录末尾的附加数据：1 字节多字节标记 (flags 位 0) + 2 字节的索引项 (flags 位 1)
+TRAILER = b'\x00' + b'\xaa\x82'
+TRAILER_FLAGS = 0b11
+
+
+class MobiBookTest(AppDirTestCase):
+    def _open(self, data):
+        book = MobiBook(self.write_file("book.mobi", data))
+        self.addCleanup(book.close)
+        return book
+
+    def test_slice_across_records(self):
+        text = bytes(range(48, 58)) * 3
+        book = self._open(_palmdb([text[:8], text[8:16], text[16:24], text[24:]], len(text), 8))
+        self.assertEqual(book[5:27], text[5:27])
+        self.assertEqual(book[0:len(text)], text)
+
+    def test_short_record_raises(self):
+        # 中间一条记录比名义长度短，按 偏移 // record_size 换算会错位，必须报错让调用方回退
+        text = b'a' * 8 + b'b' * 6 + b'c' * 8
+        book = self._open(_palmdb([text[:8], text[8:14], text[14:]], len(text), 8))
+        self.assertEqual(book[0:8], text[:8])
+        with self.assertRaises(RecordSizeError):
+            book[0:len(text)]
+
+    def test_palmdoc_with_trailing_entries(self):
+        # 记录 0: "abcd" + 重叠回溯 10 字节 + "cd" = "abcd" * 4；记录 1: 字面量 + "空格+字母"单字节
+        rec0 = b'abcd' + _backref(4, 10) + b'cd'
+        rec1 = b'xyz' + bytes([ord('k') ^ 0x80])
+        text = b'abcd' * 4 + b'xyz k'
+        book = self._open(_palmdb([rec0 + TRAILER, rec1 + TRAILER], len(text), 16, 2, TRAILER_FLAGS))
+        self.assertEqual(book[0:len(text)], text)
+        self.assertEqual(book[14:19], text[14:19])
+
+    def test_palmdoc_short_record_raises(self):
+        rec0 = b'abcd' + _backref(4, 10) # 解压后只有 14 字节
+        book = self._open(_palmdb([rec0 + TRAILER, b'xyz' + TRAILER], 17, 16, 2, TRAILER_FLAGS))
+        with self.assertRaises(RecordSizeError):
+            book[0:17]
+
+
+class MobiParserFallbackTest(AppDirTestCase):
+    """内置读取器扫描中途遇到长度不符的记录，应改用完整解包的 HTML 重扫"""
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, "book.mobi")
+        rec0 = b'abcd' + _backref(4, 10)
+        with open(self.path, 'wb') as f:
+            f.write(_palmdb([rec0 + TRAILER, b'xyz' + TRAILER], 17, 16, 2, TRAILER_FLAGS))
+        self.html = os.path.join(self.dir, "book.html")
+        with open(self.html, 'wb') as f:
+            f.write(b''.join(b'<h2>Chapter %d</h2><p>%s</p>' % (i, b'text ' * 200) for i in range(1, 4)))
+
+    def _fake_extract(self, parser):
+        parser.temp_dir, parser.html_path = self.dir, self.html
+
+    def test_record_size_error_falls_back_to_extract(self):
+        parser = MobiParser(self.path)
+        self.addCleanup(parser.close)
+        done = []
+        with mock.patch.object(MobiParser, '_extract', lambda p: self._fake_extract(p)), \
+                mock.patch('builtins.print'):
+            parser.run_scan(None, lambda *a: done.append(a[4]), 1, ScanTask())
+        self.assertIsNone(parser.book)
+        self.assertEqual([t for t, _ in parser.chapters], ["Chapter 1", "Chapter 2", "Chapter 3"])
+        self.assertEqual(done[-1:], [True])
+        self.assertIn("text", "".join(b['content'] for b in parser.load_content(1)))
+
+    def test_fallback_restarts_progress(self):
+        # 回退前已回传的章节作废：界面收到清空通知后，目录与重扫结果一一对应
+        scan = MobiParser._scan
+
+        def failing_scan(parser, callback, task_id, task):
+            if parser.book is None: return scan(parser, callback, task_id, task)
+            callback(task_id, [("Stale 1", 0), ("Stale 2", 10)], 0, 0, False)
+            raise RecordSizeError("第 1 条文本记录长 5，应为 16")
+
+        toc, events = [], []
+
+        def callback(tid, new, tc, th, done):
+            events.append(new)
+            if new is None: toc.clear()
+            elif not done: toc.extend(new)
+
+        parser = MobiParser(self.path)
+        self.addCleanup(parser.close)
+        with mock.patch.object(MobiParser, '_extract', lambda p: self._fake_extract(p)), \
+                mock.patch.object(MobiParser, '_scan', failing_scan), \
+                mock.patch('builtins.print'):
+            parser.run_scan(None, callback, 1, ScanTask())
+        self.assertIn(None, events)
+        self.assertEqual(toc + events[-1], parser.chapters)
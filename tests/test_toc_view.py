@@ -0,0 +1,83 @@
+import itertools
+import unittest
+
+from ui.toc_view import Debouncer, TitleIndex, filter_titles, normalize
+
+TITLES = ["第一章 开端", "第二章 ＡＢＣ", "第三章 归来", "番外 开端之前"]
+
+
+class FilterTitlesTest(unittest.TestCase):
+    def setUp(self):
+        self.index = TitleIndex()
+        self.index.add(TITLES)
+
+    def test_empty_query_shows_all(self):
+        self.assertEqual(filter_titles(self.index, ""), (None, None))
+
+    def test_search(self):
+        self.assertEqual(filter_titles(self.index, normalize("开端")), ([0, 3], None))
+        # 全角转半角、忽略大小写和空白
+        self.assertEqual(filter_titles(self.index, normalize("a b")), ([1], None))
+        self.assertEqual(filter_titles(self.index, normalize("不存在")), ([], None))
+
+    def test_narrowing_reuses_previous_matches(self):
+        matches, _ = filter_titles(self.index, "开端")
+        # 上次结果之外的标题即使命中也不会出现，说明只在上次结果里筛
+        self.assertEqual(filter_titles(self.index, "开端之", "开端", [3]), ([3], None))
+        self.assertEqual(filter_titles(self.index, "开端之", "开端", matches), ([3], None))
+        # 新词不包含上次的词时重新全量查找
+        self.assertEqual(filter_titles(self.index, "归来", "开端", [3]), ([2], None))
+
+    def test_jump(self):
+        self.assertEqual(filter_titles(self.index, "#2"), (None, 1))
+        self.assertEqual(filter_titles(self.index, "# 4"), (None, 3))
+
+    def test_jump_out_of_range(self):
+        self.assertEqual(filter_titles(self.index, "#0"), (None, None))
+        self.assertEqual(filter_titles(self.index, "#5"), (None, None))
+        self.assertEqual(filter_titles(TitleIndex(), "#1"), (None, None))
+
+    def test_search_after_append(self):
+        self.index.add(["第四章 开端"])
+        self.assertEqual(self.index.search("开端", 4), [4])
+        self.assertEqual(filter_titles(self.index, "开端"), ([0, 3, 4], None))
+
+
+class DebouncerTest(unittest.TestCase):
+    def setUp(self):
+        self.jobs = {} # 模拟 Tk 的 after 队列
+        self.ids = itertools.count()
+        self.calls = []
+        self.debounce = Debouncer(self._after, self.jobs.pop, 150, lambda: self.calls.append(1))
+
+    def _after(self, delay, func):
+        self.assertEqual(delay, 150)
+        job = f"after#{next(self.ids)}"
+        self.jobs[job] = func
+        return job
+
+    def _fire(self):
+        for job in list(self.jobs):
+            self.jobs.pop(job)()
+
+    def test_later_query_cancels_earlier(self):
+        self.debounce.schedule()
+        self.debounce.schedule("trace", "args")
+        self.assertEqual(len(self.jobs), 1)
+        self._fire()
+        self.assertEqual(self.calls, [1])
+        self._fire()
+        self.assertEqual(self.calls, [1])
+
+    def test_flush_runs_pending_once(self):
+        self.debounce.flush()
+        self.assertEqual(self.calls, [])
+        self.debounce.schedule()
+        self.debounce.flush()
+        self.assertEqual((self.calls, self.jobs), ([1], {}))
+        self.debounce.flush()
+        self.assertEqual(self.calls, [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
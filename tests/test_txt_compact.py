@@ -0,0 +1,136 @@
+import os
+import threading
+import unittest
+from unittest import mock
+
+import core.txt_parser as txt_parser
+from core.tasks import ScanTask
+
+from support import AppDirTestCase
+from core.txt_parser import TxtParser
+
+
+class CompactFailureTest(AppDirTestCase):
+    """合并写回：os.replace 失败（Windows 上书被其他程序占用）时片段表与编辑都不能丢，
+    成功后只缓存与完整扫描一致的索引"""
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, "book.txt")
+        self.text = "".join(f"第{i}章\n" + "正文内容。\n" * 200 for i in range(1, 6)).encode('utf-8')
+        with open(self.path, 'wb') as f:
+            f.write(self.text)
+        self.patch(
+            mock.patch.object(txt_parser, 'MMAP_THRESHOLD', 0), # 强制走 mmap
+            mock.patch.object(TxtParser, '_schedule_compact', lambda self: None), # 合并由测试手动触发
+        )
+
+    def _open(self):
+        parser = TxtParser(self.path)
+        parser.virtual_size = 0
+        self.addCleanup(parser.close)
+        parser.run_scan(r'第\d+章', lambda *a: None, 1, ScanTask())
+        return parser, parser.chapters[1][1]
+
+    def _temp_files(self):
+        return [n for n in os.listdir(self.dir) if n.endswith(".compact.tmp")]
+
+    def _check_replace_failure(self, unmap_first):
+        parser, second = self._open()
+        parser.save_content(0, "改写后的第一章")
+        expected = "改写后的第一章\n\n".encode('utf-8') + self.text[second:]
+
+        with mock.patch.object(txt_parser, 'UNMAP_BEFORE_REPLACE', unmap_first), \
+                mock.patch('os.replace', side_effect=PermissionError(13, "文件被占用")):
+            parser._compact()
+
+        self.assertEqual(parser.doc[0:len(parser.doc)], expected)
+        self.assertIn("改写后的第一章", parser.load_content(0))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.text) # 原文件未被改动
+        self.assertEqual(self._temp_files(), []) # 临时文件已清理
+
+        # 再次编辑和合并都应正常，文件内容正确
+        parser.save_content(0, "再次改写")
+        parser._compact()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), "再次改写\n\n".encode('utf-8') + self.text[second:])
+
+    def test_replace_failure_keeps_document(self):
+        self._check_replace_failure(False)
+
+    def test_replace_failure_after_unmap_rebuilds_from_journal(self):
+        self._check_replace_failure(True)
+
+    def _cached_index(self, parser):
+        return parser.index_cache.load(self.path, parser._index_key(parser.rule), parser.encoding)
+
+    def test_compact_caches_patched_index_without_virtual_split(self):
+        parser, _ = self._open()
+        parser.save_content(1, "第2章\n改写")
+        parser._compact()
+        chapters, stats = self._cached_index(parser)
+        self.assertEqual([tuple(c) for c in chapters], parser.chapters)
+
+    def test_compact_skips_patched_virtual_index(self):
+        # 增量修补出的虚拟章节与完整扫描不同，不能以新文件的键写入缓存
+        parser = TxtParser(self.path)
+        parser.virtual_size = 1024
+        self.addCleanup(parser.close)
+        parser.run_scan(r'第\d+章', lambda *a: None, 1, ScanTask())
+        parser.save_content(1, "改写" * 1000)
+        parser._compact()
+        self.assertIsNone(self._cached_index(parser))
+
+    def test_small_edits_defer_compaction(self):
+        # 一次小编辑不应立即重写整本书：推迟到空闲时，片段数超过阈值才立即合并
+        parser, _ = self._open()
+        with mock.patch.object(TxtParser, '_schedule_compact') as compact:
+            parser.save_content(0, "改写")
+            compact.assert_not_called()
+            self.assertIsNotNone(parser._compact_timer)
+            with mock.patch.object(txt_parser, 'COMPACT_MAX_PIECES', 2):
+                parser.save_content(1, "第2章\n再改")
+            compact.assert_called_once()
+        self.assertIsNone(parser._compact_timer)
+
+    def test_reopen_while_closing_parser_compacts(self):
+        # 保存后关闭、随即重新打开同一本书：两个解析器的合并不能共用临时文件或读到替换到一半的文件
+        for _ in range(5):
+            with open(self.path, 'wb') as f:
+                f.write(self.text)
+            a, second = self._open()
+            a.save_content(0, "改写后的第一章")
+            a.close()
+            closing = threading.Thread(target=a._compact)
+            closing.start()
+            b, _ = self._open()
+            closing.join()
+            b._compact()
+            with open(self.path, 'rb') as f:
+                self.assertEqual(f.read(), "改写后的第一章\n\n".encode('utf-8') + self.text[second:])
+            self.assertEqual(b.doc[0:len(b.doc)], "改写后的第一章\n\n".encode('utf-8') + self.text[second:])
+            self.assertEqual(self._temp_files(), [])
+            b.close()
+
+    def test_scan_after_failed_compaction_reads_piece_table(self):
+        # 扫描前的合并失败时仍要给出目录和完成回调，目录按未写回的编辑计算
+        parser, second = self._open()
+        parser.save_content(0, "改写后的第一章")
+        errors, done = [], []
+        parser.on_error = errors.append
+        with mock.patch('os.replace', side_effect=PermissionError(13, "文件被占用")), \
+                mock.patch.object(txt_parser, 'SCAN_BLOCK', 1024), \
+                mock.patch.object(txt_parser, 'EOL_WINDOW', 7):
+            parser.run_scan(r'第\d+章', lambda *a: done.append(a[4]), 2, ScanTask())
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(done[-1:], [True])
+        self.assertEqual(len(parser.chapters), 5)
+        self.assertEqual(parser.chapters[1], ("第2章", len("改写后的第一章\n\n".encode('utf-8'))))
+        self.assertIn("改写后的第一章", parser.load_content(0))
+        # 磁盘上的文件仍是旧内容，缓存的仍是旧文件的目录
+        self.assertEqual(self._cached_index(parser)[0][1][1], second)
+
+
+if __name__ == "__main__":
+    unittest.main()
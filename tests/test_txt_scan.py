@@ -0,0 +1,243 @@
+import os
+import random
+import unittest
+from unittest import mock
+
+import core.txt_parser as txt_parser
+from core.tasks import ScanTask
+
+from support import AppDirTestCase
+from core.txt_parser import TxtParser
+
+
+class ParallelVirtualSplitTest(AppDirTestCase):
+    """多进程分段扫描的虚拟章节必须与单线程扫描一致，段边界处不能留下超长章节"""
+
+    VIRTUAL = 64 * 1024
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, "book.txt")
+        rnd = random.Random(1)
+        parts = []
+        for i in range(1, 16):
+            parts.append(f"第{i}章 标题\n")
+            # 标题之间是几百 KB 的长段落，偶尔夹着空行
+            for _ in range(rnd.randint(2000, 9000)):
+                parts.append("正文" * rnd.randint(5, 60) + ("\n\n" if rnd.random() < 0.05 else "\n"))
+        with open(self.path, 'wb') as f:
+            f.write("".join(parts).encode('utf-8'))
+        self.patch(
+            mock.patch.object(txt_parser, 'MMAP_THRESHOLD', 0),
+            mock.patch.object(txt_parser, 'PARALLEL_CHUNK', txt_parser.SCAN_BLOCK), # 每段一块，段边界尽量多
+        )
+
+    def _scan(self, parallel):
+        parser = TxtParser(self.path)
+        parser.virtual_size = self.VIRTUAL
+        self.addCleanup(parser.close)
+        with mock.patch.object(TxtParser, '_use_parallel', lambda self: parallel), \
+                mock.patch.object(parser.index_cache, 'load', lambda *a: None):
+            parser.run_scan(r'第\d+章', lambda *a: None, 1, ScanTask())
+        return parser
+
+    def test_parallel_matches_serial(self):
+        serial, parallel = self._scan(False), self._scan(True)
+        self.assertGreater(len(serial.chapters), 30)
+        self.assertEqual(parallel.chapters, serial.chapters)
+        self.assertEqual(parallel.chapter_stats, serial.chapter_stats)
+        offsets = [pos for _, pos in parallel.chapters] + [len(parallel.doc)]
+        self.assertLessEqual(max(b - a for a, b in zip(offsets, offsets[1:])),
+                             self.VIRTUAL + self.VIRTUAL // 8)
+
+    def _write_chapters(self, sizes, seed):
+        """按给定的字节数写出一串有标题的章节，返回每章起点"""
+        rnd, parts, starts, pos = random.Random(seed), [], [], 0
+        for i, size in enumerate(sizes, 1):
+            starts.append(pos)
+            chapter = [f"第{i}章 标题\n".encode('utf-8')]
+            length = len(chapter[0])
+            while length < size:
+                line = ("正文" * rnd.randint(5, 60) + ("\n\n" if rnd.random() < 0.05 else "\n")).encode('utf-8')
+                chapter.append(line)
+                length += len(line)
+            parts.extend(chapter)
+            pos += length
+        with open(self.path, 'wb') as f:
+            f.write(b"".join(parts))
+        return starts
+
+    def test_short_chapters_are_not_split(self):
+        # 不超过 virtual_size 的章节即使跨过网格点也不切
+        starts = self._write_chapters([int(self.VIRTUAL * 0.9)] * 60, 3)
+        for parallel in (False, True):
+            parser = self._scan(parallel)
+            self.assertEqual([pos for _, pos in parser.chapters], starts)
+            self.assertFalse([t for t, _ in parser.chapters if t.startswith(txt_parser.VIRTUAL_TITLE)])
+
+    def test_mixed_chapters_parallel_matches_serial(self):
+        rnd = random.Random(4)
+        sizes = [int(self.VIRTUAL * rnd.choice((0.2, 0.6, 0.95, 1.5, 3, 6)) * rnd.uniform(0.9, 1.1))
+                 for _ in range(150)]
+        starts = self._write_chapters(sizes, 5)
+        serial, parallel = self._scan(False), self._scan(True)
+        self.assertEqual(parallel.chapters, serial.chapters)
+        self.assertEqual(parallel.chapter_stats, serial.chapter_stats)
+        # 真实标题都在；不超长的章节不切，明显超长的（离两端都留得出 slack）一定切
+        offsets = [pos for _, pos in serial.chapters]
+        self.assertTrue(set(starts) <= set(offsets))
+        slack = self.VIRTUAL // txt_parser.VIRTUAL_SLACK
+        for s, e in zip(starts, starts[1:] + [len(serial.doc)]):
+            inner = [p for p in offsets if s < p < e]
+            if e - s <= self.VIRTUAL: self.assertEqual(inner, [])
+            elif e - s > self.VIRTUAL + 2 * slack: self.assertTrue(inner)
+
+    def test_headingless_book_needs_few_rescans(self):
+        # 没有标题的书：虚拟切点只取决于绝对位置，工作进程的结果基本不用在主进程重扫
+        rnd = random.Random(2)
+        with open(self.path, 'wb') as f:
+            f.write("".join("正文" * rnd.randint(5, 60) + ("\n\n" if rnd.random() < 0.05 else "\n")
+                            for _ in range(120000)).encode('utf-8'))
+        serial = self._scan(False)
+        scan_block, rescans = txt_parser._scan_block, []
+
+        def counting_scan_block(*args):
+            rescans.append(args[1])
+            return scan_block(*args)
+
+        with mock.patch.object(txt_parser, '_scan_block', counting_scan_block):
+            parallel = self._scan(True)
+        self.assertGreater(len(serial.chapters), 50)
+        self.assertEqual(parallel.chapters, serial.chapters)
+        self.assertEqual(parallel.chapter_stats, serial.chapter_stats)
+        blocks = len(list(txt_parser._iter_blocks(parallel.file_bytes, 0, len(parallel.file_bytes))))
+        self.assertLess(len(rescans), blocks // 2)
+
+    def test_fallback_to_serial_restarts_progress(self):
+        # 进程池中途失败回退单线程：已回传的章节作废，界面收到清空通知后从头追加
+        def broken_parallel(parser, rule, finder, reg, emit, task):
+            emit([("第1章 标题", 0), ("第2章 标题", 100)], [(0, 0), (1, 1), (1, 1)], 200)
+            raise OSError("进程池不可用")
+
+        toc, events = [], []
+
+        def callback(tid, new, tc, th, done):
+            events.append(new)
+            if new is None: toc.clear()
+            elif not done: toc.extend(new)
+
+        parser = TxtParser(self.path)
+        parser.virtual_size = self.VIRTUAL
+        self.addCleanup(parser.close)
+        with mock.patch.object(TxtParser, '_use_parallel', lambda self: True), \
+                mock.patch.object(TxtParser, '_scan_parallel', broken_parallel), \
+                mock.patch.object(txt_parser, 'PROGRESS_INTERVAL', 0), \
+                mock.patch.object(txt_parser, '_discard_process_pool', lambda: None), \
+                mock.patch('builtins.print'):
+            parser.run_scan(r'第\d+章', callback, 1, ScanTask())
+        self.assertIn(None, events)
+        self.assertEqual(toc + events[-1], parser.chapters)
+
+
+class InvalidRuleRescanTest(AppDirTestCase):
+    """有效规则扫描后改用无效规则重扫：全文成为一章，旧目录的章节缓存不能再被读到"""
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, "book.txt")
+        with open(self.path, 'wb') as f:
+            f.write("前言\n第1章\n正文一\n第2章\n正文二\n".encode('utf-8'))
+
+    def test_invalid_rule_after_valid_scan(self):
+        parser = TxtParser(self.path)
+        parser.virtual_size = 0
+        self.addCleanup(parser.close)
+        parser.run_scan(r'第\d+章', lambda *a: None, 1, ScanTask())
+        self.assertEqual(parser.get_content(0), "前言\n")
+        parser._scan_limit = 4 # 被取消的扫描留下的上限
+
+        parser.run_scan(r'第(\d+章', lambda *a: None, 2, ScanTask())
+        self.assertEqual(len(parser.chapters), 1)
+        self.assertIsNone(parser.rule)
+        content = parser.get_content(0)
+        self.assertEqual(content, parser.load_content(0))
+        self.assertIn("正文二", content)
+
+    def test_read_error_finishes_scan(self):
+        # 扫描中途读取出错：仍要发出完成回调并清除扫描上限，之后可以正常保存
+        self.patch(mock.patch.object(TxtParser, '_schedule_compact', lambda self: None))
+        parser = TxtParser(self.path)
+        parser.virtual_size = 0
+        self.addCleanup(parser.close)
+        done, errors = [], []
+        parser.on_error = errors.append
+        with mock.patch.object(txt_parser, '_scan_block', side_effect=OSError(5, "读取失败")):
+            parser.run_scan(r'第\d+章', lambda *a: done.append(a[4]), 1, ScanTask())
+        self.assertEqual(done, [True])
+        self.assertEqual(len(errors), 1)
+        self.assertIsNone(parser._scan_limit)
+        self.assertTrue(parser.save_content(0, "改写"))
+
+    def test_invalid_rule_still_splits_by_size(self):
+        # 规则无效时不能整本成为一章：仍按大小切出虚拟章节
+        self.write_file("book.txt", ("正文内容。\n" * 20000).encode('utf-8'))
+        parser = TxtParser(self.path)
+        parser.virtual_size = 16 * 1024
+        self.addCleanup(parser.close)
+        done = []
+        parser.run_scan(r'第(\d+章', lambda *a: done.append(a[4]), 1, ScanTask())
+        self.assertEqual(done[-1:], [True])
+        self.assertIsNone(parser.rule)
+        self.assertGreater(len(parser.chapters), 10)
+        self.assertTrue(all(t.startswith(txt_parser.VIRTUAL_TITLE) for t, _ in parser.chapters[1:]))
+        self.assertEqual(parser.total_chars, 20000 * 6)
+
+
+class ReindexEditTest(AppDirTestCase):
+    """编辑虚拟章节后的增量重扫：被编辑的章节仍从原处切开，不能整段并入上一章"""
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, "book.txt")
+        with open(self.path, 'wb') as f:
+            f.write(("第1章\n" + ("x" * 50 + "\n") * 100 + "第2章\n正文\n").encode('utf-8'))
+        self.patch(mock.patch.object(TxtParser, '_request_compact', lambda self: None))
+
+    def _scan(self):
+        parser = TxtParser(self.path)
+        parser.virtual_size = 1024
+        self.addCleanup(parser.close)
+        with mock.patch.object(parser.index_cache, 'load', lambda *a: None):
+            parser.run_scan(r'第\d+章', lambda *a: None, 1, ScanTask())
+        return parser
+
+    def test_edit_virtual_chapter_with_heading(self):
+        parser = self._scan()
+        idx = next(i for i, (t, _) in enumerate(parser.chapters) if t.startswith(txt_parser.VIRTUAL_TITLE))
+        start = parser.chapters[idx][1]
+        # 一整行长文字 + 新标题
+        parser.save_content(idx, "a" * 3000 + "\n第9章 插入\n" + "b" * 200)
+        self.assertIn(start, [pos for _, pos in parser.chapters])
+        self.assertIn("第9章 插入", [t for t, _ in parser.chapters])
+
+        with open(self.path, 'wb') as f:
+            f.write(parser.doc[0:len(parser.doc)])
+        full = self._scan()
+        cut = [pos for t, pos in full.chapters].index(start) + 2 # 被编辑章节及新标题
+        self.assertEqual(parser.chapters[:cut], full.chapters[:cut])
+        # 新标题之后的虚拟切点只做平移，与完整扫描可以不同（这样的索引不写入缓存）
+        self.assertEqual(parser.chapter_stats[:cut - 1], full.chapter_stats[:cut - 1])
+        self.assertEqual(parser.total_chars, full.total_chars)
+
+    def test_save_refused_while_scanning(self):
+        # 扫描中末章只显示到已扫描的位置，保存会按最终范围删掉未显示的部分
+        parser = self._scan()
+        parser._scan_limit = parser.chapters[-1][1] + 3 # 扫描进行中
+        before = parser.doc[0:len(parser.doc)]
+        with self.assertRaises(RuntimeError):
+            parser.save_content(len(parser.chapters) - 1, "第2章")
+        self.assertEqual(parser.doc[0:len(parser.doc)], before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,32 @@
 # ui/app.py
-import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import time, os, sys, json, re
+from bisect import bisect_left, bisect_right
+from tkinter import font as tkfont
 from .styles import THEMES, APP_NAME, DEFAULT_REG, REG_TEMPLATES
+from .toc_view import TocView
 from utils.config import ConfigManager
-from io import BytesIO
 from PIL import Image, ImageTk
 
 from core.parser_factory import ParserFactory
+from core.tasks import IMAGE_EXECUTOR
+from utils.image_cache import IMAGE_CACHE
+
+# 渐进渲染：首屏同步插入的字符数、之后每片的字符数与间隔 (ms)；一张图片按这么多字符计
+RENDER_FIRST_CHARS = 6000
+RENDER_SLICE_CHARS = 30000
+RENDER_SLICE_DELAY = 1
+RENDER_IMG_COST = 2000
+# 以这些标点开头的段落首行少缩进半个字，标点悬挂在正文左侧
+QUOTE_CHARS = '“「『"‘'
+# 插图按视口懒加载：可见区上下各预载这么多屏；已显示图片的像素总量超过上限时释放视口外的
+IMG_PRELOAD_SCREENS = 1
+IMG_MEMORY_LIMIT = 96 * 1024 * 1024
+IMG_CHECK_DELAY = 50
+IMG_PLACEHOLDER = " [正在加载图片...] "
+IMG_FAILED_TEXT = " [图片加载失败] "
+IMG_PENDING, IMG_LOADING, IMG_SHOWN, IMG_FAILED = 0, 1, 2, 3
 
 class ReaderApp:
     def __init__(self, root):
@@ -22,8 +40,14 @@ class ReaderApp:
         self.current_ch_idx = 0
         self.is_editing = False
         self.current_task_id = 0
-        self.display_chapters = []
+        self.scan_task = None # 当前目录解析任务，重新解析/切换书籍时取消
         self.is_indexing = False
+        self._render_gen = 0 # 章节渲染代数，翻章时递增以作废未完成的分片和图片
+        self._render_job = None
+        # 本章插图槽位（按行号有序）：占位行号、原始数据、状态、PhotoImage
+        self._img_slots, self._img_lines = [], []
+        self._img_bytes = 0 # 已显示图片的像素字节数
+        self._img_job = None
 
         self._init_vars()
         self._setup_ui()
@@ -45,6 +69,8 @@ class ReaderApp:
         self.line_spacing = tk.DoubleVar(value=s.get("line_spacing", 1.6))
         self.theme_name = tk.StringVar(value=s.get("theme", "warm"))
         self.chapter_rule = tk.StringVar(value=s.get("rule", DEFAULT_REG))
+        self.prefetch_radius = s.get("prefetch_radius", 1) # 渲染后预取前后几章
+        self.virtual_chapter_kb = s.get("virtual_chapter_kb", 256) # TXT 无标题长段落的自动分段大小，0 为不分段
         
         self.status_var = tk.StringVar(value="准备就绪")
         self.stats_var = tk.StringVar(value="全书: 0 | 汉字: 0")
@@ -52,7 +78,6 @@ class ReaderApp:
         self.ch_stats_var = tk.StringVar()
         self.timer_var = tk.StringVar(value="计时初始化...")
         self.ch_inner_progress = tk.StringVar(value="章内: 0%")
-        self.search_var = tk.StringVar()
         self.reg_tmpl_var = tk.StringVar(value="标准模式 (推荐)")
 
     def _setup_ui(self):
@@ -103,22 +128,14 @@ class ReaderApp:
         self.paned.pack(fill=tk.BOTH, expand=True)
         
         # 左侧目录
-        self.left_frame = tk.Frame(self.paned)
-        tk.Entry(self.left_frame, textvariable=self.search_var).pack(fill=tk.X, padx=5, pady=5)
-        self.search_var.trace_add("write", lambda *a: self.refresh_dir())
-        self.dir_list = tk.Listbox(self.left_frame, width=30, borderwidth=0, font=("Microsoft YaHei", 10))
-        self.dir_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        dir_scroll = ttk.Scrollbar(self.left_frame, command=self.dir_list.yview)
-        dir_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-        self.dir_list.config(yscrollcommand=dir_scroll.set)
-        self.dir_list.bind("<<ListboxSelect>>", self.on_dir_click)
-        self.paned.add(self.left_frame, weight=1)
+        self.toc = TocView(self.paned, self.show_chapter)
+        self.paned.add(self.toc, weight=1)
 
         # 右侧正文
         self.right_frame = tk.Frame(self.paned)
         self.text_scroll = ttk.Scrollbar(self.right_frame)
         self.text_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-        self.text = tk.Text(self.right_frame, wrap=tk.WORD, undo=True, borderwidth=0, 
+        self.text = tk.Text(self.right_frame, wrap=tk.WORD, undo=False, borderwidth=0, 
                             padx=50, pady=30, yscrollcommand=self._on_scroll_sync)
         self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.text_scroll.config(command=self.text.yview)
@@ -128,6 +145,7 @@ class ReaderApp:
 
     def _on_scroll_sync(self, *args):
         self.text_scroll.set(*args)
+        self._schedule_img_check()
         try:
             top, bottom = float(args[0]), float(args[1])
             percent = 100 if bottom >= 0.99 else int(bottom * 100)
@@ -147,7 +165,10 @@ class ReaderApp:
         return "\n".join(clean_lines)
 
     def _apply_visual_kerning(self):
-        """标点外挂：让引号行向左偏移 0.5 个字符，对标业内顶尖阅读 App"""
+        """标点外挂：让引号行向左偏移 0.5 个字符，对标业内顶尖阅读 App
+
+        这里只配置标签；每行用哪个标签在插入前由 _text_pieces 判断，随文字一起插入。
+        """
         sz = self.font_size.get()
         
         # 1. 设置基础正文标签：首行缩进 2 个字符
@@ -157,106 +178,226 @@ class ReaderApp:
         # 这样文本内容其实还是在 2.0 的位置对齐，只是引号突出去一点
         self.text.tag_configure("para_quote", lmargin1=sz * 1.5, lmargin2=0) 
 
-        # 清除之前的旧标签（防止切换章节后重叠）
-        for tag in ["para_normal", "para_quote"]:
-            self.text.tag_remove(tag, "1.0", tk.END)
-
-        idx = "1.0"
-        while True:
-            # 搜索每一行的开头
-            line_start = self.text.search(r"^.", idx, stopindex=tk.END, regexp=True)
-            if not line_start: break
-            
-            line_num = line_start.split('.')[0]
-            # 获取该行第一个字符
-            first_char = self.text.get(line_start)
-            
-            # 判断是否为引号/特殊标点
-            if first_char in '“「『"‘':
-                self.text.tag_add("para_quote", f"{line_num}.0", f"{line_num}.end")
-            else:
-                self.text.tag_add("para_normal", f"{line_num}.0", f"{line_num}.end")
-                
-            idx = f"{line_num}.end+1c" # 移动到下一行开头
-
-    def show_chapter(self, idx):
+    def _text_pieces(self, text, limit=RENDER_SLICE_CHARS):
+        """正文 -> 渲染片段 ('text', insert 参数, 字符数)
+
+        insert 参数形如 (文字, 标签, 文字, 标签, ...)，相邻同样式的行合并成一段，
+        一个片段只需一次 Tk 调用；编辑模式不加缩进标签。首片约 limit 个字符，之后每片 RENDER_SLICE_CHARS。
+        """
+        tagged = not self.is_editing
+        args, run, run_tag, size = [], [], None, 0
+        for line in text.split("\n"):
+            tag = ("para_quote" if line[:1] in QUOTE_CHARS else "para_normal") if tagged else ""
+            if tag != run_tag and run:
+                args += ("".join(run), run_tag)
+                run = []
+            run.append(line + "\n")
+            run_tag = tag
+            size += len(line) + 1
+            if size >= limit:
+                args += ("".join(run), run_tag)
+                yield 'text', args, size
+                args, run, size, limit = [], [], 0, RENDER_SLICE_CHARS
+        run.append("\n") # 段落块之间空一行
+        args += ("".join(run), run_tag)
+        yield 'text', args, size + 1
+
+    def show_chapter(self, idx, on_done=None):
+        """渲染章节：首屏同步插入，其余分片交给 after 逐步追加，翻章时丢弃未完成的渲染"""
         if not self.parser: return
         self.current_ch_idx = idx
+        self._cancel_render()
+        self.toc.select(idx)
+
+        # 本章字数（解析器提供每章统计时才显示）
+        stats = self.parser.chapter_stats
+        if 0 <= idx < len(stats):
+            self.ch_stats_var.set(f"本章: {stats[idx][0]:,} | 汉字: {stats[idx][1]:,}")
+        else:
+            self.ch_stats_var.set("")
         
         # 获取块列表
         blocks = self.parser.get_content(idx)
         if isinstance(blocks, str):
             blocks = [{'type': 'text', 'content': blocks}]
 
-        self.text.config(state=tk.NORMAL)
+        # 阅读模式不记录撤销历史，整章插入不再复制一份到 undo 栈
+        self.text.config(state=tk.NORMAL, undo=self.is_editing)
         self.text.delete("1.0", tk.END)
         
-        if not hasattr(self, 'image_refs'): self.image_refs = []
-        self.image_refs.clear()
+        self._reset_img_slots()
         self.text.tag_configure("img_center", justify='center')
+        self.apply_style()
+
+        gen = self._render_gen
+        # 编辑模式需要完整内容才能保存，一次性渲染
+        first = None if self.is_editing else RENDER_FIRST_CHARS
+        pieces = self._render_pieces(blocks, first or RENDER_SLICE_CHARS)
+        self._render_step(gen, pieces, first, on_done)
+
+        # 后台预取相邻章节，翻页时直接命中缓存
+        self.parser.prefetch(idx, self.prefetch_radius)
+
+    def _cancel_render(self):
+        self._render_gen += 1
+        if self._render_job:
+            self.root.after_cancel(self._render_job)
+            self._render_job = None
+
+    def _render_pieces(self, blocks, first=RENDER_SLICE_CHARS):
+        """块列表 -> 渲染片段 (类型, 内容, 开销)；超长文本按行切片
 
-        # 优化：先快速渲染所有文字，图片留出占位符，然后异步加载图片
+        首屏的 first 个字符可能跨越多个块（如短标题 + 长正文），剩余额度带到下一块，用完后每片约一片大小。
+        """
         for block in blocks:
             if block['type'] == 'text':
-                display_text = self._format_content_for_read(block['content'])
-                if display_text:
-                    self.text.insert(tk.END, display_text + "\n\n")
-            
+                s = self._format_content_for_read(block['content'])
+                if s:
+                    for piece in self._text_pieces(s, first if first > 0 else RENDER_SLICE_CHARS):
+                        first -= piece[2]
+                        yield piece
             elif block['type'] == 'img':
-                # 插入一个占位标记
-                self.text.insert(tk.END, "\n")
-                placeholder_idx = self.text.index(tk.INSERT)
-                self.text.insert(tk.END, " [正在加载图片...] \n\n", "img_center")
-                
-                # 开启线程处理图片缩放，避免阻塞主线程
-                threading.Thread(target=self._async_load_img, 
-                               args=(block['content'], placeholder_idx), 
-                               daemon=True).start()
-
-        if not self.is_editing:
-            self.text.config(state=tk.DISABLED)
-            self._apply_visual_kerning()
-        
-        self.apply_style()
+                first -= RENDER_IMG_COST
+                yield 'img', block['content'], RENDER_IMG_COST
 
-    def _async_load_img(self, raw_data, index_str):
-        """后台缩放图片并回到主线程插入"""
-        try:
-            from io import BytesIO
-            from PIL import Image, ImageTk
-            
-            pil_img = Image.open(BytesIO(raw_data))
-            
-            # 这里的宽度计算可以稍作延迟以获取最新窗口宽
-            win_w = self.text.winfo_width() - 120
-            if win_w < 100: win_w = 800
-            
-            if pil_img.size[0] > win_w:
-                ratio = win_w / float(pil_img.size[0])
-                pil_img = pil_img.resize((win_w, int(pil_img.size[1]*ratio)), Image.Resampling.LANCZOS)
-            
-            tk_img = ImageTk.PhotoImage(pil_img)
-            
-            # 回到主线程更新 UI
-            self.root.after(0, lambda: self._insert_img_to_text(tk_img, index_str))
-        except Exception as e:
-            print(f"异步图片处理失败: {e}")
+    def _render_step(self, gen, pieces, budget, on_done):
+        """插入约 budget 个字符（None 为全部），未完成则预约下一片"""
+        self._render_job = None
+        if gen != self._render_gen: return
+        self.text.config(state=tk.NORMAL)
+        used = 0
+        for kind, content, cost in pieces:
+            used += cost
+            if kind == 'text':
+                self.text.insert(tk.END, *content)
+            else:
+                # 插入一个占位标记，滚动到附近时才解码替换
+                self.text.insert(tk.END, "\n")
+                line = int(self.text.index("end-1c").split('.')[0])
+                tag = f"img_slot{len(self._img_slots)}"
+                self.text.insert(tk.END, IMG_PLACEHOLDER + "\n\n", ("img_center", tag))
+                self._img_slots.append({'line': line, 'data': content, 'tag': tag,
+                                        'state': IMG_PENDING, 'img': None, 'bytes': 0, 'job': None})
+                self._img_lines.append(line)
+            if budget is not None and used >= budget:
+                if not self.is_editing: self.text.config(state=tk.DISABLED)
+                self._render_job = self.root.after(
+                    RENDER_SLICE_DELAY, lambda: self._render_step(gen, pieces, RENDER_SLICE_CHARS, on_done))
+                self._schedule_img_check()
+                return
+
+        # 全部插入完毕
+        self._schedule_img_check()
+        if not self.is_editing: self.text.config(state=tk.DISABLED)
+        self.text.edit_reset()
+        if on_done: on_done()
+
+    def _img_width(self):
+        """图片最大显示宽度，在主线程读取窗口尺寸"""
+        win_w = self.text.winfo_width() - 120
+        return win_w if win_w >= 100 else 800
+
+    def _reset_img_slots(self):
+        if self._img_job:
+            self.root.after_cancel(self._img_job)
+            self._img_job = None
+        for slot in self._img_slots:
+            if slot['job']: slot['job'].cancel() # 还在排队的解码不必再做
+        if self._img_slots: self.text.tag_delete(*[slot['tag'] for slot in self._img_slots])
+        self._img_slots, self._img_lines = [], []
+        self._img_bytes = 0
+
+    def _schedule_img_check(self):
+        if self._img_job is None and self._img_slots:
+            self._img_job = self.root.after(IMG_CHECK_DELAY, self._check_visible_imgs)
+
+    def _check_visible_imgs(self):
+        """按视口（首尾行 @0,0 / @0,高度）决定解码哪些插图，可见的优先，其次上下预载区"""
+        self._img_job = None
+        if not self._img_slots: return
+        top = int(self.text.index("@0,0").split('.')[0])
+        bottom = int(self.text.index(f"@0,{self.text.winfo_height()}").split('.')[0])
+        margin = max(bottom - top + 1, 4) * IMG_PRELOAD_SCREENS
+        lines = self._img_lines
+        lo, hi = bisect_left(lines, top - margin), bisect_right(lines, bottom + margin)
+        # 已滚出预载范围、还在排队的解码撤回，等再次靠近时重新排队
+        for i, slot in enumerate(self._img_slots):
+            if slot['state'] == IMG_LOADING and not lo <= i < hi and slot['job'].cancel():
+                slot.update(state=IMG_PENDING, job=None)
+
+        vis_lo, vis_hi = bisect_left(lines, top), bisect_right(lines, bottom)
+        order = list(range(vis_lo, vis_hi)) + list(range(vis_hi, hi)) + list(range(vis_lo - 1, lo - 1, -1))
+        width, gen = self._img_width(), self._render_gen
+        for i in order:
+            slot = self._img_slots[i]
+            if slot['state'] == IMG_PENDING:
+                job = IMAGE_EXECUTOR.submit(IMAGE_CACHE.get_or_decode, slot['data'], width)
+                slot.update(state=IMG_LOADING, job=job)
+                job.add_done_callback(lambda f, slot=slot: self._on_img_decoded(f, slot, gen))
+        if self._img_bytes > IMG_MEMORY_LIMIT: self._release_imgs(lo, hi)
+
+    def _release_imgs(self, lo, hi):
+        """内存超限：从离视口最远的开始，把预载区外的图片换回占位行"""
+        far = [i for i, slot in enumerate(self._img_slots)
+               if slot['state'] == IMG_SHOWN and not lo <= i < hi]
+        far.sort(key=lambda i: -min(abs(i - lo), abs(i - hi)))
+        line_h = tkfont.Font(font=self.text.cget("font")).metrics("linespace")
+        state = self.text.cget("state")
+        self.text.config(state=tk.NORMAL)
+        for i in far:
+            if self._img_bytes <= IMG_MEMORY_LIMIT: break
+            slot = self._img_slots[i]
+            line = slot['line']
+            if self.text.dlineinfo(f"{line}.0") is not None: continue # 仍在屏幕上
+            h = slot['img'].height()
+            self.text.delete(f"{line}.0", f"{line}.end")
+            self.text.insert(f"{line}.0", IMG_PLACEHOLDER, ("img_center", slot['tag']))
+            # 占位行撑到原图高度，滚动条的比例和位置不会因释放而突变
+            self.text.tag_configure(slot['tag'], spacing1=max(h - line_h, 0))
+            self._img_bytes -= slot['bytes']
+            slot.update(state=IMG_PENDING, img=None, bytes=0)
+        self.text.config(state=state)
+
+    def _on_img_decoded(self, job, slot, gen):
+        """解码线程完成（或撤回）时调用，结果交回主线程处理；槽位状态只在主线程修改"""
+        if job.cancelled(): return
+        self.root.after(0, lambda: self._finish_img(job, slot, gen))
+
+    def _finish_img(self, job, slot, gen):
+        if gen != self._render_gen or slot['job'] is not job: return # 已翻到别的章节
+        slot['job'] = None
+        e = job.exception()
+        if e is None:
+            self._insert_img_to_text(job.result(), slot)
+            return
+        print(f"异步图片处理失败: {e}")
+        slot['state'] = IMG_FAILED
+        line = slot['line']
+        state = self.text.cget("state")
+        self.text.config(state=tk.NORMAL)
+        self.text.delete(f"{line}.0", f"{line}.end")
+        self.text.insert(f"{line}.0", IMG_FAILED_TEXT, ("img_center", slot['tag']))
+        self.text.config(state=state)
 
-    def _insert_img_to_text(self, tk_img, index_str):
+    def _insert_img_to_text(self, decoded, slot):
         """将处理好的图片替换掉占位符"""
-        self.image_refs.append(tk_img)
+        mode, size, raw = decoded
+        tk_img = ImageTk.PhotoImage(Image.frombuffer(mode, size, raw, 'raw', mode, 0, 1))
+        slot.update(state=IMG_SHOWN, img=tk_img, bytes=size[0] * size[1] * 4)
+        self._img_bytes += slot['bytes']
+        state = self.text.cget("state")
         self.text.config(state=tk.NORMAL)
         
         # 找到占位符所在行的起始和结束
-        line_start = f"{index_str} linestart"
-        line_end = f"{index_str} lineend + 1c"
+        line_start = f"{slot['line']}.0"
+        line_end = f"{slot['line']}.0 lineend + 1c"
         
         self.text.delete(line_start, line_end)
         self.text.image_create(line_start, image=tk_img)
         self.text.tag_add("img_center", line_start)
         self.text.insert(line_start + " + 1c", "\n")
         
-        self.text.config(state=tk.DISABLED)
+        self.text.config(state=state)
 
     # --- 定位与解析 ---
         # --- 修复后的定位与解析 ---
@@ -266,11 +407,20 @@ class ReaderApp:
         
         try:
             # 统一通过工厂获取
-            self.parser = ParserFactory.get_parser(path)
+            parser = ParserFactory.get_parser(path)
         except Exception as e:
             messagebox.showerror("格式错误", f"无法加载文件: {e}")
             return
 
+        # 释放旧书占用的句柄/映射，旧书剩余的渲染分片一并作废
+        self._cancel_render()
+        if self.parser: self.parser.close()
+        self.parser = parser
+        if hasattr(parser, 'virtual_size'): parser.virtual_size = self.virtual_chapter_kb * 1024
+        if hasattr(parser, 'on_error'):
+            name = os.path.basename(path)
+            parser.on_error = lambda msg: self.root.after(0, lambda: messagebox.showwarning("出错", f"{name}\n{msg}"))
+
         self.book_start = time.time()
         
         # 1. 核心修复：从配置读取历史位置
@@ -284,9 +434,11 @@ class ReaderApp:
         # 2. 开始解析
         self.re_index()
 
-    def _sync_ui(self, tc, th, done):
-        """解析完成后的 UI 同步逻辑"""
-        if done:
+    def _sync_ui(self, tc, th, done, new_chapters=()):
+        """解析完成后的 UI 同步逻辑；解析中只增量追加新章节，new_chapters 为 None 表示扫描从头重来"""
+        if new_chapters is None:
+            self.toc.clear()
+        elif done:
             self.is_indexing = False
             self.status_var.set(os.path.basename(self.current_file))
             self.stats_var.set(f"全书: {tc:,} | 汉字: {th:,}")
@@ -305,13 +457,9 @@ class ReaderApp:
                     # EPUB 模式：直接使用保存的章节索引
                     best_idx = self.temp_saved_idx
                 
-                # 执行跳转
-                self.show_chapter(best_idx)
-                
-                # 恢复滚动条位置
-                def _restore_scroll():
-                    self.text.yview_moveto(self.temp_saved_offset)
-                self.root.after(200, _restore_scroll)
+                # 执行跳转，整章渲染完成后恢复滚动条位置（分片渲染中比例还不准）
+                offset = self.temp_saved_offset
+                self.show_chapter(best_idx, on_done=lambda: self.text.yview_moveto(offset))
                 
                 # 任务完成，删除标记变量
                 delattr(self, 'temp_saved_byte')
@@ -320,6 +468,7 @@ class ReaderApp:
         else:
             # 正在解析中的进度条显示
             self.stats_var.set(f"解析中: {tc//10000}万字...")
+            self._append_dir(new_chapters)
 
 
     # 禁止非 TXT 格式修改
@@ -331,6 +480,10 @@ class ReaderApp:
         if ext != '.txt' and not self.is_editing:
             messagebox.showwarning("只读格式", f"抱歉，{ext.upper()} 格式目前仅支持阅读，暂不支持在线编辑。")
             return
+        # 解析中末章还没扫完，编辑的只会是其中一截
+        if self.is_indexing and not self.is_editing:
+            messagebox.showinfo("正在解析", "目录解析完成后才能编辑。")
+            return
 
         self.is_editing = not self.is_editing
         self.edit_btn.config(text="📖 退出编辑" if self.is_editing else "📝 编辑 (E)")
@@ -342,11 +495,20 @@ class ReaderApp:
         self.is_indexing = True
         self.current_task_id += 1
         self.status_var.set("正在解析目录...")
-        self.parser.scan(self.chapter_rule.get(), self._index_callback, self.current_task_id)
+        self.toc.clear()
+        if self.scan_task: self.scan_task.cancel()
+        self.scan_task = self.parser.scan(self.chapter_rule.get(), self._index_callback, self.current_task_id)
 
     def _index_callback(self, tid, chapters, tc, th, done):
         if tid != self.current_task_id: return
-        self.root.after(0, lambda: self._sync_ui(tc, th, done))
+        def _apply():
+            # 排队期间可能已开始新的解析任务
+            if tid == self.current_task_id: self._sync_ui(tc, th, done, chapters)
+        self.root.after(0, _apply)
+
+    def _append_dir(self, new_chapters):
+        """解析过程中把新章节追加到目录末尾"""
+        self.toc.append([title for title, _ in new_chapters])
 
 
 
@@ -360,12 +522,13 @@ class ReaderApp:
         self.text.config(bg=t["bg"], fg=t["fg"], font=("Microsoft YaHei", sz), 
                          spacing1=sz, spacing2=line_sp, spacing3=0, insertbackground=t["fg"])
         # 更新背景容器，实现主题全覆盖
-        self.left_frame.config(bg=t["l_bg"])
+        self.toc.config(bg=t["l_bg"])
         self.right_frame.config(bg=t["bg"])
-        self.dir_list.config(bg=t["l_bg"], fg=t["fg"], selectbackground=t["select"])
+        self.toc.listbox.config(bg=t["l_bg"], fg=t["fg"], selectbackground=t["select"])
         
         # 默认缩进
         self.text.tag_configure("in", lmargin1=sz*2, lmargin2=0)
+        self._apply_visual_kerning()
 
     def _update_timer(self):
         if self.current_file:
@@ -394,16 +557,8 @@ class ReaderApp:
 
     def refresh_dir(self):
         if not self.parser: return
-        search = self.search_var.get().lower()
-        self.dir_list.delete(0, tk.END)
-        self.display_chapters = []
-        for i, (title, pos) in enumerate(self.parser.chapters):
-            if not search or search in title.lower():
-                self.display_chapters.append(i)
-                self.dir_list.insert(tk.END, f" {title}")
-        for i, orig_idx in enumerate(self.display_chapters):
-            if orig_idx == self.current_ch_idx:
-                self.dir_list.selection_set(i); self.dir_list.see(i); break
+        self.toc.set_chapters([title for title, _ in self.parser.chapters])
+        self.toc.select(self.current_ch_idx, see=True)
 
     def save_session_settings(self):
         if not self.parser or not self.current_file: return
@@ -424,6 +579,8 @@ class ReaderApp:
             "font_size": self.font_size.get(), 
             "theme": self.theme_name.get(), 
             "rule": self.chapter_rule.get(), 
+            "prefetch_radius": self.prefetch_radius,
+            "virtual_chapter_kb": self.virtual_chapter_kb,
             "last_file": self.current_file, 
             "files": f_map
         })
@@ -447,16 +604,20 @@ class ReaderApp:
 
     def save_edit(self):
         if self.parser and self.is_editing:
-            if self.parser.save_content(self.current_ch_idx, self.text.get("1.0", tk.END)):
-                messagebox.showinfo("成功", "内容已保存"); self.re_index()
+            try:
+                saved = self.parser.save_content(self.current_ch_idx, self.text.get("1.0", tk.END))
+            except (OSError, RuntimeError) as e:
+                # 解析中（编辑时重新解析了目录）拒绝保存，编辑内容留在窗口里，解析完成后可再保存
+                messagebox.showerror("保存失败", f"无法保存编辑: {e}")
+                return
+            if saved:
+                messagebox.showinfo("成功", "内容已保存")
+                # 解析器已就地修补目录
+                self._sync_ui(self.parser.total_chars, self.parser.total_han, True)
 
     def change_chapter(self, delta):
         if not self.is_editing: self.show_chapter(self.current_ch_idx + delta)
 
-    def on_dir_click(self, e):
-        sel = self.dir_list.curselection()
-        if sel: self.show_chapter(self.display_chapters[sel[0]])
-
     def _bind_events(self):
         self.root.bind("<KeyPress-Left>", lambda e: self.change_chapter(-1))
         self.root.bind("<KeyPress-Right>", lambda e: self.change_chapter(1))
@@ -466,4 +627,5 @@ class ReaderApp:
 
     def on_close(self):
         self.save_session_settings()
+        if self.parser: self.parser.close()
         self.root.destroy()
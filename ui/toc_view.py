@@ -0,0 +1,243 @@
+# ui/toc_view.py
+import bisect
+import re
+import unicodedata
+from itertools import compress
+import tkinter as tk
+from tkinter import font as tkfont
+from tkinter import ttk
+
+SEARCH_DELAY = 150 # 搜索防抖 (ms)
+WHEEL_ROWS = 3 # 滚轮一格滚动的行数
+JUMP_RE = re.compile(r'^#\s*(\d+)$') # "#123" 跳到第 123 章
+
+
+def normalize(title):
+    """搜索用的规范化标题：全角转半角、忽略大小写和空白"""
+    return "".join(unicodedata.normalize('NFKC', title).casefold().split())
+
+
+class TitleIndex:
+    """目录标题的搜索索引：规范化标题逐行拼接成一个字符串，一次 find 扫过全部标题"""
+
+    def __init__(self):
+        self.titles = []
+        self.keys = [] # 规范化后的标题
+        self.starts = [] # 每个标题在 haystack 中的起点
+        self.haystack = ""
+
+    def add(self, titles):
+        pos, parts = len(self.haystack), []
+        for t in titles:
+            key = normalize(t)
+            self.starts.append(pos)
+            parts.append(key)
+            pos += len(key) + 1
+        self.titles += titles
+        self.keys += parts
+        self.haystack += "\n".join(parts) + "\n"
+
+    def search(self, query, start=0):
+        """从第 start 个标题起查找包含 query 的标题，返回章节索引列表"""
+        hay, starts, out = self.haystack, self.starts, []
+        pos = starts[start] if start < len(starts) else len(hay)
+        if hay.count(query, pos) > (len(starts) - start) // 8:
+            # 命中密集时逐条判断，比逐个命中再二分定位快
+            keys = self.keys
+            return list(compress(range(start, len(keys)), [query in k for k in keys[start:]]))
+        while True:
+            pos = hay.find(query, pos)
+            if pos < 0: return out
+            i = bisect.bisect_right(starts, pos) - 1
+            out.append(i)
+            pos = starts[i + 1] if i + 1 < len(starts) else len(hay)
+
+
+def filter_titles(index, query, prev=None, matches=None):
+    """按 query（已规范化）过滤目录，返回 (matches, target)
+
+    matches 为命中的章节索引，None 表示不过滤；target 为 "#N" 跳转的目标章，不是跳转或越界时为 None。
+    prev/matches 为上一次的过滤词和结果，新词包含上次的词时只在上次结果里筛。
+    """
+    m = JUMP_RE.match(query)
+    if m:
+        target = int(m.group(1)) - 1
+        return None, target if 0 <= target < len(index.titles) else None
+    if not query:
+        return None, None
+    if prev and prev in query and matches is not None:
+        keys = index.keys
+        return [i for i in matches if query in keys[i]], None
+    return index.search(query), None
+
+
+class Debouncer:
+    """防抖：delay 毫秒内重复 schedule 只执行最后一次；after/after_cancel 通常取自 Tk 控件"""
+
+    def __init__(self, after, after_cancel, delay, func):
+        self._after, self._after_cancel = after, after_cancel
+        self.delay, self.func = delay, func
+        self._job = None
+
+    def schedule(self, *args):
+        self.cancel()
+        self._job = self._after(self.delay, self._run)
+
+    def cancel(self):
+        if self._job:
+            self._after_cancel(self._job)
+            self._job = None
+
+    def flush(self):
+        """有待执行的调用时立即执行"""
+        if self._job:
+            self.cancel()
+            self.func()
+
+    def _run(self):
+        self._job = None
+        self.func()
+
+
+class TocView(tk.Frame):
+    """目录面板：搜索框 + 虚拟滚动列表
+
+    Listbox 里只放当前可见的几十行，滚动时按偏移重新填充，章节再多 Tk 调用量也不变。
+    搜索输入防抖后在预建的规范化索引上查找；"#123" 直接定位到第 123 章，回车打开。
+    """
+
+    def __init__(self, master, on_select, font=("Microsoft YaHei", 10), **kw):
+        super().__init__(master, **kw)
+        self.on_select = on_select
+        self.index = TitleIndex()
+        self.matches = None # 过滤结果（章节索引），None 表示不过滤
+        self.query = ""
+        self.top = 0 # 列表首行对应第几条结果
+        self.rows = 20 # 可完整显示的行数
+        self.current = -1 # 高亮的章节
+
+        self.search_var = tk.StringVar()
+        self.entry = tk.Entry(self, textvariable=self.search_var)
+        self.entry.pack(fill=tk.X, padx=5, pady=5)
+        self.listbox = tk.Listbox(self, width=30, borderwidth=0, font=font, activestyle='none', exportselection=False)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scroll = ttk.Scrollbar(self, command=self._yview)
+        self.scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self._line_h = max(tkfont.Font(font=font).metrics("linespace"), 1)
+
+        self._search = Debouncer(self.after, self.after_cancel, SEARCH_DELAY, self._apply_search)
+        self.search_var.trace_add("write", self._search.schedule)
+        self.entry.bind("<Return>", self._on_enter)
+        self.listbox.bind("<<ListboxSelect>>", self._on_click)
+        self.listbox.bind("<Configure>", self._on_resize)
+        self.listbox.bind("<MouseWheel>", lambda e: self._wheel(-1 if e.delta > 0 else 1))
+        self.listbox.bind("<Button-4>", lambda e: self._wheel(-1))
+        self.listbox.bind("<Button-5>", lambda e: self._wheel(1))
+
+    # --- 数据 ---
+    @property
+    def titles(self):
+        return self.index.titles
+
+    def clear(self):
+        self.index = TitleIndex()
+        self.top = 0
+        self._filter()
+        self._render()
+
+    def set_chapters(self, titles):
+        """整体替换目录（解析完成/编辑保存后）"""
+        titles = list(titles)
+        if titles != self.titles:
+            self.index = TitleIndex()
+            self.index.add(titles)
+            self._filter()
+        self._render()
+
+    def append(self, titles):
+        """解析过程中追加新章节，只为新增部分建索引和过滤"""
+        if not titles: return
+        start = len(self.titles)
+        self.index.add(titles)
+        if self.matches is not None and not JUMP_RE.match(self.query):
+            self.matches += self.index.search(self.query, start)
+        self._render()
+
+    def _filter(self, prev=None):
+        """按 self.query 重新过滤；编号跳转不过滤，只把目标章滚到视野里并高亮"""
+        self.matches, target = filter_titles(self.index, self.query, prev, self.matches)
+        if target is not None:
+            self.current = target
+            self.top = target - self.rows // 3
+
+    # --- 搜索 ---
+    def _apply_search(self):
+        query = self.search_var.get().strip()
+        prev, self.query = self.query, query if JUMP_RE.match(query) else normalize(query)
+        self.top = 0
+        self._filter(None if JUMP_RE.match(prev) else prev)
+        self._render()
+
+    def _on_enter(self, e=None):
+        self._search.flush()
+        m = JUMP_RE.match(self.query)
+        if m:
+            target = int(m.group(1)) - 1
+            if 0 <= target < len(self.titles): self.on_select(target)
+        elif self._count():
+            self.on_select(self._at(0))
+
+    # --- 显示 ---
+    def select(self, idx, see=False):
+        """高亮章节；see 为真时滚动到它所在位置"""
+        self.current = idx
+        if see:
+            pos = idx if self.matches is None else bisect.bisect_left(self.matches, idx)
+            if pos < self._count() and self._at(pos) == idx and not self.top <= pos < self.top + self.rows:
+                self.top = pos - self.rows // 3
+        self._render()
+
+    def _count(self):
+        return len(self.titles) if self.matches is None else len(self.matches)
+
+    def _at(self, pos):
+        return pos if self.matches is None else self.matches[pos]
+
+    def _render(self):
+        total = self._count()
+        self.top = max(0, min(self.top, total - self.rows))
+        end = min(self.top + self.rows + 1, total) # 多放一行，填满底部半行
+        items = range(self.top, end) if self.matches is None else self.matches[self.top:end]
+        self.listbox.delete(0, tk.END)
+        if items:
+            self.listbox.insert(tk.END, *[f" {self.titles[i]}" for i in items])
+            for row, i in enumerate(items):
+                if i == self.current:
+                    self.listbox.selection_set(row)
+                    break
+        if total: self.scroll.set(self.top / total, min((self.top + self.rows) / total, 1.0))
+        else: self.scroll.set(0.0, 1.0)
+
+    def _yview(self, *args):
+        total = self._count()
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * total)
+        elif args[0] == 'scroll':
+            self.top += int(args[1]) * (self.rows if args[2] == 'pages' else 1)
+        self._render()
+
+    def _wheel(self, step):
+        self.top += step * WHEEL_ROWS
+        self._render()
+        return "break"
+
+    def _on_resize(self, e):
+        rows = max(e.height // self._line_h, 1)
+        if rows != self.rows:
+            self.rows = rows
+            self._render()
+
+    def _on_click(self, e=None):
+        sel = self.listbox.curselection()
+        if sel and self.top + sel[0] < self._count():
+            self.on_select(self._at(self.top + sel[0]))
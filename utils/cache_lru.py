@@ -0,0 +1,25 @@
+import os
+
+
+def touch(path):
+    """命中时刷新修改时间，作为 LRU 淘汰的最近使用时间"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict_lru(entries, max_entries, max_bytes, remove, keep=None):
+    """按最近使用时间淘汰缓存条目，直到条数和总大小都不超过上限
+
+    entries 为 [(最近使用时间, 字节数, 路径), ...]，remove(路径) 负责删除；
+    keep 计入条数和总大小，但永不删除（如当前正在使用的条目）。
+    """
+    total = sum(size for _, size, _ in entries)
+    count = len(entries)
+    for _, size, p in sorted(entries):
+        if count <= max_entries and total <= max_bytes: break
+        if p == keep: continue
+        remove(p)
+        total -= size
+        count -= 1
@@ -2,12 +2,36 @@ import json
 import os
 import sys
 
+
+def get_app_dir():
+    """配置与缓存所在目录：打包后为 exe 所在目录，源码运行时为 utils 目录"""
+    return os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__)
+
+
+def _user_cache_root():
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "NovelReader")
+
+
+def get_cache_dir(name):
+    """返回 cache/<name> 子目录，不存在时自动创建
+
+    程序目录不可写（如装在 Program Files 下）时改用用户目录；都不可用时返回 None，
+    调用方据此只关闭缓存，不影响打开书籍。
+    """
+    for root in (get_app_dir(), _user_cache_root()):
+        path = os.path.join(root, "cache", name)
+        try:
+            os.makedirs(path, exist_ok=True)
+            if os.access(path, os.W_OK): return path
+        except OSError:
+            pass
+    return None
+
+
 class ConfigManager:
     def __init__(self, filename="reader_settings.json"):
-        self.path = os.path.join(
-            os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else __file__), 
-            filename
-        )
+        self.path = os.path.join(get_app_dir(), filename)
         self.settings = self.load()
 
     def load(self):
@@ -18,5 +18,27 @@ def detect_encoding(chunk):
             pass
     return 'utf-8'
 
+# UTF-8 下 U+4E00–U+9FFF 的首字节为 E4（次字节 B8–BF）及 E5–E9；续字节只在 80–BF，不会混淆
+_NOT_HAN_LEAD = bytes(b for b in range(256) if not 0xE4 <= b <= 0xE9)
+_E4_BELOW_HAN = re.compile(rb'\xe4[\x80-\xb7]') # U+4000–U+4DFF，不属于统计范围
+
+def _count_han_leads(data):
+    """按首字节统计，要求每个首字节后都跟着完整的续字节（任何 str 编码出的字节都满足）"""
+    leads = data.translate(None, _NOT_HAN_LEAD)
+    if b'\xe4' in leads:
+        return len(leads) - len(_E4_BELOW_HAN.findall(data))
+    return len(leads)
+
+def count_han_utf8(data):
+    """直接在 UTF-8 字节上精确统计 U+4E00–U+9FFF 汉字数：一次 translate 保留首字节后计长度，不逐字分配
+
+    含非法或截断序列时，孤立的首字节不能算作汉字：先按 surrogateescape 解码，结果与 count_chinese_chars 一致。
+    """
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError:
+        return count_chinese_chars(data.decode('utf-8', errors='surrogateescape'))
+    return _count_han_leads(data)
+
 def count_chinese_chars(text):
-    return len(re.findall(r'[\u4e00-\u9fff]', text))
+    return _count_han_leads(text.encode('utf-8', errors='surrogatepass'))
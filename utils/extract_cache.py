@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from utils.cache_lru import evict_lru, touch
+from utils.config import get_cache_dir
+
+# 淘汰策略：超过条数/总大小时按最近使用时间淘汰整本书的解压目录
+MAX_ENTRIES = 30
+MAX_BYTES = 2 * 1024 * 1024 * 1024
+FINGERPRINT_BYTES = 64 * 1024
+META = "meta.json"
+
+
+def fingerprint(path):
+    """快速文件指纹：大小 + 首尾各 64KB 的哈希，不必读完整个文件"""
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(size - FINGERPRINT_BYTES, FINGERPRINT_BYTES))
+            h.update(f.read(FINGERPRINT_BYTES))
+    return h.hexdigest()
+
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+class ExtractCache:
+    """MOBI/AZW 解压结果的磁盘缓存
+
+    每本书一个以文件指纹命名的子目录，存放解压出的整棵目录和 meta.json（正文 HTML 的相对路径、总大小）。
+    再次打开同一本书时直接复用，不必重新解压；meta.json 的修改时间作为最近使用时间。
+    """
+
+    def __init__(self, cache_dir=None):
+        self.dir = cache_dir or get_cache_dir("mobi") # 为 None 时每次打开都重新解压
+
+    def load(self, key):
+        """命中返回 (解压目录, 正文 HTML 路径)，否则返回 None"""
+        if not self.dir: return None
+        entry = os.path.join(self.dir, key)
+        meta = _read_meta(entry)
+        if meta is None: return None
+        try:
+            html_path = os.path.join(entry, meta["html"])
+            if not os.path.isfile(html_path): return None
+            touch(os.path.join(entry, META))
+            return entry, html_path
+        except Exception:
+            return None
+
+    def store(self, key, temp_dir, html_path):
+        """把临时解压目录移入缓存，返回缓存内的 (解压目录, 正文 HTML 路径)；失败返回 None"""
+        if not self.dir: return None
+        entry = os.path.join(self.dir, key)
+        tmp = entry + ".tmp"
+        try:
+            shutil.rmtree(tmp, ignore_errors=True)
+            shutil.move(temp_dir, tmp)
+            rel = os.path.relpath(html_path, temp_dir)
+            with open(os.path.join(tmp, META), 'w', encoding='utf-8') as f:
+                json.dump({"html": rel, "size": _dir_size(tmp)}, f, ensure_ascii=False)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+            self.evict(keep=key)
+            return entry, os.path.join(entry, rel)
+        except Exception as e:
+            print(f"解压缓存写入失败: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return None
+
+    def evict(self, keep=None):
+        """按 LRU 淘汰，keep 为当前正在使用的条目，永不删除"""
+        if not self.dir: return
+        entries = []
+        for name in os.listdir(self.dir):
+            p = os.path.join(self.dir, name)
+            if not os.path.isdir(p): continue
+            meta = _read_meta(p)
+            if meta is None:
+                # 没有 meta 的残留目录（写入中断），超过一小时直接清理
+                try:
+                    if time.time() - os.stat(p).st_mtime > 3600: shutil.rmtree(p, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            entries.append((meta["mtime"], meta.get("size", 0), p))
+
+        evict_lru(entries, MAX_ENTRIES, MAX_BYTES, lambda p: shutil.rmtree(p, ignore_errors=True),
+                  keep=keep and os.path.join(self.dir, keep))
+
+
+def _read_meta(entry):
+    path = os.path.join(entry, META)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        meta["mtime"] = os.stat(path).st_mtime
+        return meta
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,81 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+# 缩放后图片的内存缓存上限（按解码后的像素字节数计）
+MAX_IMAGE_CACHE = 96 * 1024 * 1024
+# 目标宽度按这个步长向下取整，窗口拖动几个像素不必重新解码
+WIDTH_STEP = 32
+
+
+def image_key(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def decode_scaled(data, max_width):
+    """解码并等比缩到不超过 max_width，返回 (mode, (宽, 高), 像素字节, 原始宽度)
+
+    JPEG 先用 draft() 让解码器直接按 1/2、1/4、1/8 缩小解码，其余格式由
+    resize 的 reducing_gap 先做整数倍缩小，再 LANCZOS 到目标尺寸。
+    只产出原始像素，PhotoImage 必须留到 Tk 主线程创建。
+    """
+    img = Image.open(BytesIO(data))
+    natural = img.size[0]
+    if natural > max_width:
+        w, h = img.size
+        size = (max_width, max(int(h * max_width / w), 1))
+        img.draft('RGB', size)
+    mode = 'RGBA' if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info else 'RGB'
+    img = img.convert(mode)
+    if natural > max_width:
+        img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return mode, img.size, img.tobytes(), natural
+
+
+class ImageCache:
+    """缩放结果的 LRU 缓存，键为 (图片内容哈希, 目标宽度)
+
+    本身不比目标宽度宽的图片与宽度无关，统一存在宽度 0 下，改变窗口大小也直接命中。
+    """
+
+    def __init__(self, max_size=MAX_IMAGE_CACHE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._natural = {} # 哈希 -> 原始宽度，解码过一次后即可判断是否需要缩放
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_or_decode(self, data, width):
+        width = max(width // WIDTH_STEP * WIDTH_STEP, WIDTH_STEP)
+        key = image_key(data)
+        with self._lock:
+            natural = self._natural.get(key)
+            if natural is not None and natural <= width: width = 0
+            item = self._items.get((key, width))
+            if item is not None:
+                self._items.move_to_end((key, width))
+                return item
+        # 解码在锁外进行，多个工作线程可以同时解码不同的图片
+        mode, size, raw, natural = decode_scaled(data, width or natural)
+        item = (mode, size, raw)
+        with self._lock:
+            self._natural[key] = natural
+            self._put((key, 0 if natural <= width else width), item)
+        return item
+
+    def _put(self, key, item):
+        size = len(item[2])
+        if size > self.max_size: return
+        old = self._items.pop(key, None)
+        if old: self._size -= len(old[2])
+        self._items[key] = item
+        self._size += size
+        while self._size > self.max_size:
+            _, (_, _, raw) = self._items.popitem(last=False)
+            self._size -= len(raw)
+
+
+IMAGE_CACHE = ImageCache()
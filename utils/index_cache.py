@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import time
+
+from utils.cache_lru import evict_lru, touch
+from utils.config import get_cache_dir
+
+# 淘汰策略：超过条数/总大小时按最近使用时间淘汰，超过期限的直接删除
+MAX_ENTRIES = 300
+MAX_BYTES = 64 * 1024 * 1024
+MAX_AGE = 90 * 24 * 3600
+
+
+class IndexCache:
+    """章节索引磁盘缓存
+
+    以 路径 + 文件大小 + 修改时间 + 规则/编码 的哈希为键，保存章节偏移、标题和每章字数统计，
+    重新打开同一本书时无需再扫描正文。文件一旦被修改，键随之变化，旧条目由淘汰策略回收。
+    """
+
+    def __init__(self, cache_dir=None):
+        self.dir = cache_dir or get_cache_dir("index") # None 表示缓存不可用
+
+    def _entry_path(self, path, rule, encoding):
+        st = os.stat(path)
+        rule_hash = hashlib.sha1(f"{rule}\0{encoding}".encode('utf-8', 'surrogatepass')).hexdigest()
+        raw = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{rule_hash}"
+        key = hashlib.sha1(raw.encode('utf-8', 'surrogatepass')).hexdigest()
+        return os.path.join(self.dir, key + ".json")
+
+    def load(self, path, rule, encoding):
+        """命中返回 (chapters, chapter_stats)，否则返回 None"""
+        if not self.dir: return None
+        try:
+            entry = self._entry_path(path, rule, encoding)
+            if not os.path.exists(entry): return None
+            with open(entry, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            touch(entry)
+            return [tuple(c) for c in data["chapters"]], [tuple(c) for c in data["stats"]]
+        except Exception:
+            return None
+
+    def store(self, path, rule, encoding, chapters, chapter_stats):
+        if not self.dir: return
+        try:
+            entry = self._entry_path(path, rule, encoding)
+            tmp = entry + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({"chapters": chapters, "stats": chapter_stats}, f, ensure_ascii=False)
+            os.replace(tmp, entry)
+            self.evict()
+        except Exception as e:
+            print(f"索引缓存写入失败: {e}")
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.dir):
+            p = os.path.join(self.dir, name)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            if now - st.st_mtime > MAX_AGE:
+                self._remove(p)
+            else:
+                entries.append((st.st_mtime, st.st_size, p))
+        evict_lru(entries, MAX_ENTRIES, MAX_BYTES, self._remove)
+
+    @staticmethod
+    def _remove(p):
+        try:
+            os.remove(p)
+        except OSError:
+            pass